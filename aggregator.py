@@ -0,0 +1,122 @@
+import time
+import numpy as np
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+rank = comm.Get_rank()
+size = comm.Get_size()
+
+from mpidata import mpidata
+from columnstore import batchkey, batchevents, mergebatches, DROPMETA
+
+#
+# optional aggregation tree: instead of every worker sending to rank 0, one
+# aggregator rank per node (or per group of workers) merges the batches of
+# its workers into larger ones and forwards those to the master.
+#
+
+class topology(object):
+    """
+    role of every rank: 'master', 'aggregator' or 'worker'. parent is the rank
+    this rank sends to, children the ranks sending to it. Workers are numbered
+    0..nworkers-1 (workerindex) to split the events of xtc files.
+    """
+    def __init__(self, parents):
+        #parents: parent rank of every rank, None for the master
+        self.parents = parents
+        self.parent = parents[rank]
+        self.children = [r for r,p in enumerate(parents) if p==rank]
+        haschildren = set(p for p in parents if p is not None)
+        workers = [r for r in range(len(parents)) if r not in haschildren]
+        self.nworkers = len(workers)
+        self.workerindex = workers.index(rank) if rank in workers else -1
+        if self.parent is None:
+            self.role = 'master'
+        elif rank in haschildren:
+            self.role = 'aggregator'
+        else:
+            self.role = 'worker'
+
+def maketopology(aggregate=None):
+    """
+    aggregate: None for a flat layout (all workers send to rank 0), 'node'
+    for one aggregator per host, or an integer K for one aggregator per K
+    workers. Workers on the master's host always send to the master directly.
+    Collective: all ranks need to call this.
+    """
+    hostnames=comm.allgather(MPI.Get_processor_name())
+    parents=[None]+[0]*(size-1)
+    if aggregate is None:
+        return topology(parents)
+    if aggregate=='node':
+        groups={}
+        for r in range(1,size):
+            if hostnames[r]!=hostnames[0]:
+                groups.setdefault(hostnames[r], []).append(r)
+        groups=list(groups.values())
+    else:
+        ranks=list(range(1,size))
+        groups=[ranks[i:i+int(aggregate)+1] for i in range(0, len(ranks), int(aggregate)+1)]
+    for group in groups:
+        #an aggregator needs at least two workers to merge anything
+        if len(group)<3:
+            continue
+        for r in group[1:]:
+            parents[r]=group[0]
+    return topology(parents)
+
+class batchmerger(object):
+    """
+    collects batches and concatenates the event columns of batches with the
+    same layout. The per-batch columns keep the last value, except nEvts_sent
+    which is summed.
+    """
+    def __init__(self):
+        self.pending = {}
+        self.nrows = 0
+
+    def add(self, columns, indexcol='event_time'):
+        columns=[(name, np.array(arr)) for name,arr in columns]
+        self.pending.setdefault(batchkey(columns), []).append(columns)
+        self.nrows+=batchevents(columns, indexcol)
+
+    def merged(self):
+        #list of merged batches, one per layout; empties the merger
+        batches=[mergebatches(batchlist) for batchlist in self.pending.values()]
+        self.pending={}
+        self.nrows=0
+        return batches
+
+def runaggregator(topo, maxrows=1000, maxdelay=1., grant=4, policy=None):
+    """
+    merge the batches of topo.children and forward them to topo.parent once
+    maxrows events are waiting or the oldest has waited maxdelay seconds.
+    Forwards the end of run when all children have ended. grant and policy
+    are the flow control towards the children and the parent (see mpidata).
+    """
+    inbox=mpidata(grant=grant)
+    outbox=mpidata(dest=topo.parent, policy=policy)
+    #the drops of our children go up with our own
+    outbox.upstream=inbox
+    merger=batchmerger()
+    nopen=len(topo.children)
+    firstpending=None
+    print('aggregator rank %d: merging batches of ranks %s for rank %d'%(rank, topo.children, topo.parent))
+    while nopen>0:
+        if inbox.poll():
+            batch=inbox.recvbatch()
+            if batch.endrun:
+                nopen-=1
+            else:
+                if merger.nrows==0:
+                    firstpending=time.time()
+                merger.add(batch.columns)
+            inbox.release(batch)
+        else:
+            time.sleep(0.001)
+        if merger.nrows>=maxrows or (merger.nrows>0 and time.time()-firstpending>maxdelay) or (nopen==0 and merger.nrows>0):
+            for columns in merger.merged():
+                for name,arr in columns:
+                    if name not in DROPMETA:
+                        outbox.addarray(name,arr)
+                outbox.isend()
+    outbox.endrun()
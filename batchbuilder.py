@@ -0,0 +1,199 @@
+import numpy as np
+from columnstore import fillvalue
+
+class batchbuilder(object):
+    """
+    the events of the next batch of a worker, one preallocated column per
+    variable. A column is made when its variable first shows up, with the
+    dtype and shape of that value and room for `size` rows; set() writes the
+    value of the current event in place and next() moves on to the next
+    event. Variables an event did not set get a fill value (NaN or 0). A
+    value that does not fit the dtype of its column (4.7 in an int column)
+    promotes the column, as np.array of the values would have.
+    columns() are views of the first nrows rows, ready for mpidata.addarray;
+    the transport packs them, so clear() can reuse the buffers right away.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.buffers = {}
+        #names in the order they showed up
+        self.names = []
+        #row after the last one each column has a value for
+        self.filled = {}
+        self.nrows = 0
+
+    def _newcolumn(self, name, value):
+        value=np.asarray(value)
+        col=np.empty((self.size,)+value.shape, dtype=value.dtype)
+        col[:self.nrows]=fillvalue(col.dtype)
+        self.buffers[name]=col
+        self.names.append(name)
+        return col
+
+    def _grow(self):
+        #more events than size before the batch went out
+        self.size*=2
+        for name,col in self.buffers.items():
+            grown=np.empty((self.size,)+col.shape[1:], dtype=col.dtype)
+            grown[:self.nrows]=col[:self.nrows]
+            self.buffers[name]=grown
+
+    def _promote(self, name, dtype):
+        col=self.buffers[name]
+        print('batchbuilder: %s promoted from %s to %s'%(name, col.dtype, dtype))
+        promoted=np.empty(col.shape, dtype=dtype)
+        promoted[:self.nrows]=col[:self.nrows]
+        self.buffers[name]=promoted
+        return promoted
+
+    def set(self, name, value):
+        if self.nrows==self.size:
+            self._grow()
+        col=self.buffers.get(name)
+        if col is None:
+            col=self._newcolumn(name, value)
+        else:
+            dtype=np.asarray(value).dtype
+            if not np.can_cast(dtype, col.dtype, 'same_kind'):
+                col=self._promote(name, np.result_type(col.dtype, dtype))
+        try:
+            col[self.nrows]=value
+        except ValueError:
+            print('batchbuilder: %s of shape %s does not fit its column of %s, filling'%(name, np.shape(value), col.shape[1:]))
+            return
+        self.filled[name]=self.nrows+1
+
+    def next(self):
+        #the current event is complete; returns the number of events in the batch
+        if self.nrows==self.size:
+            self._grow()
+        row=self.nrows
+        for name in self.names:
+            if self.filled.get(name, 0)<=row:
+                col=self.buffers[name]
+                col[row]=fillvalue(col.dtype)
+        self.nrows+=1
+        return self.nrows
+
+    def columns(self, start=0, stop=None):
+        #views of rows start to stop (default nrows)
+        stop=self.nrows if stop is None else stop
+        return [(name, self.buffers[name][start:stop]) for name in self.names]
+
+    def clear(self):
+        #start the next batch in the same buffers
+        self.nrows=0
+        self.filled={}
+
+def _layout(data):
+    #the detectors and how many variables each has, -1 for a plain value
+    return tuple((key, len(value) if isinstance(value, dict) else -1) for key,value in data.items())
+
+class flattenplan(object):
+    """
+    which values of the nested event data (detector -> variable -> value,
+    or a plain value) go into which batch column. The plan is made from the
+    first event: the '<detector>__<variable>' names are formatted and
+    checked with select(name) once (plain values with selectplain, by default
+    select), after that every event only follows the list of (detector,
+    variable, column). It is made again when the detectors or the number of
+    variables of one of them change, or a planned value is missing.
+    """
+    def __init__(self, select, selectplain=None):
+        self.select = select
+        self.selectplain = select if selectplain is None else selectplain
+        self.layout = None
+        self.entries = []
+
+    def _compile(self, data):
+        entries=[]
+        for key,value in data.items():
+            if not isinstance(value, dict):
+                if self.selectplain(key):
+                    entries.append((key, None, key))
+                continue
+            for skey,svalue in value.items():
+                if isinstance(svalue, dict):
+                    print('flattenplan: why do I have this level of dict? %s %s %s'%(key, skey, list(svalue.keys())))
+                    continue
+                name='%s__%s'%(key, skey)
+                if self.select(name):
+                    entries.append((key, skey, name))
+        self.entries=entries
+        self.layout=_layout(data)
+
+    def fill(self, data, batch):
+        #write the planned values of data into the current event of batch
+        if _layout(data)!=self.layout:
+            self._compile(data)
+        try:
+            for key,skey,name in self.entries:
+                batch.set(name, data[key] if skey is None else data[key][skey])
+        except KeyError:
+            self._compile(data)
+            for key,skey,name in self.entries:
+                batch.set(name, data[key] if skey is None else data[key][skey])
+
+class sendpolicy(object):
+    """
+    when a worker sends its batch: once it holds size events, or once its
+    first event has waited maxage seconds, so slow data still shows up in
+    time. adaptive: size follows the measured event rate so a batch fills
+    in about latency seconds, but stays large enough that the nworkers
+    together send at most maxbatchrate batches a second to the master.
+    Every number of rows is a new batch layout the master registers, so the
+    adaptive size is a power of two and batches sent early go out in chunks
+    of powers of two (see chunks). Those chunks are not counted against
+    maxbatchrate: a batch only goes out early when fewer than size events
+    came in maxage seconds, and then as at most log2(size)+1 messages, so
+    the nworkers add up to nworkers*(log2(size)+1)/maxage messages a second.
+    """
+    def __init__(self, size=50, maxage=1., adaptive=False, latency=0.5, maxbatchrate=200., nworkers=1, minsize=1, maxsize=10000):
+        self.size = size
+        self.maxage = maxage
+        self.adaptive = adaptive
+        self.latency = latency
+        self.maxbatchrate = maxbatchrate
+        self.nworkers = nworkers
+        self.minsize = minsize
+        self.maxsize = maxsize
+        #events per second of this worker, averaged over the last batches
+        self.rate = None
+        self.first = None
+        self.lastsend = None
+
+    def due(self, nrows, now):
+        #called after every event added and for every event skipped; True if
+        #the batch of nrows events should go out
+        if nrows==0:
+            return False
+        if self.first is None:
+            self.first=now
+        return nrows>=self.size or now-self.first>=self.maxage
+
+    def sent(self, nrows, now):
+        #the batch of nrows events went out at now
+        if self.lastsend is not None and now>self.lastsend:
+            rate=nrows/(now-self.lastsend)
+            self.rate=rate if self.rate is None else 0.7*self.rate+0.3*rate
+        self.lastsend=now
+        self.first=None
+        if self.adaptive and self.rate is not None:
+            #the latency target rounded down to a power of two, the floor
+            #from maxbatchrate rounded up, so rounding never exceeds the rate
+            size=1<<(int(max(self.rate*self.latency, self.minsize, 1)).bit_length()-1)
+            floor=int(np.ceil(self.rate*self.nworkers/self.maxbatchrate))
+            if floor>size:
+                size=1<<(floor-1).bit_length()
+            self.size=min(size, 1<<(int(self.maxsize).bit_length()-1))
+
+    def chunks(self, nrows):
+        #sizes of the batches to send nrows events in: nrows if that is the
+        #full size, otherwise powers of two, largest first
+        if nrows==self.size:
+            return [nrows]
+        sizes=[]
+        while nrows>0:
+            sizes.append(1<<(nrows.bit_length()-1))
+            nrows-=sizes[-1]
+        return sizes
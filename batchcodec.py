@@ -0,0 +1,127 @@
+import zlib
+import struct
+import numpy as np
+try:
+    import lz4.block as lz4block
+except ImportError:
+    lz4block = None
+
+#
+# optional compression of the batch payload for transfers between hosts.
+# Each column is byte-shuffled (the n-th byte of every value grouped together,
+# which makes slowly varying numbers and projections compress well) and then
+# compressed on its own. Small batches and columns are sent as they are, and
+# columns that do not shrink by at least minratio are left alone for a while.
+#
+# encoded payload: one codec entry per column (codec id, encoded length),
+# then the encoded columns back to back.
+#
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+CODEC_LZ4 = 2
+SHUFFLE = 0x80
+CODECS = {'zlib': CODEC_ZLIB, 'lz4': CODEC_LZ4}
+_codechead = struct.Struct('<B7xQ')
+
+#codec set up by setup(); mpidata uses it for destinations on other hosts.
+default = None
+
+def shuffle(data, itemsize):
+    return np.ascontiguousarray(np.frombuffer(data, dtype=np.uint8).reshape(-1, itemsize).T)
+
+def unshuffle(data, itemsize):
+    return np.ascontiguousarray(np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1).T)
+
+def _compress(codec, data):
+    if codec==CODEC_LZ4:
+        return lz4block.compress(data, store_size=False)
+    return zlib.compress(data, 1)
+
+def _decompress(codec, data, nbytes):
+    if codec==CODEC_LZ4:
+        return lz4block.decompress(data, uncompressed_size=nbytes)
+    return zlib.decompress(data)
+
+class batchcodec(object):
+    """
+    codec: 'lz4', 'zlib' or 'auto' (lz4 if installed, else zlib).
+    Batches below minbatch bytes and columns below minbytes are not compressed.
+    """
+    def __init__(self, codec='auto', minbatch=16384, minbytes=4096, minratio=0.8, skipbatches=20):
+        if codec=='auto':
+            codec='lz4' if lz4block is not None else 'zlib'
+        if codec=='lz4' and lz4block is None:
+            raise ValueError('lz4 is not installed')
+        self.codec = CODECS[codec]
+        self.minbatch = minbatch
+        self.minbytes = minbytes
+        self.minratio = minratio
+        self.skipbatches = skipbatches
+        #column name -> batches left before we try to compress it again
+        self.skip = {}
+        self.nraw = 0
+        self.nencoded = 0
+
+    def encode(self, layout, arrays):
+        """
+        list of (codec id, bytes) per column, or None if the batch is not
+        worth compressing.
+        """
+        if layout.nbytes<self.minbatch:
+            return None
+        encoded=[]
+        gained=False
+        for name,dtype,arr in zip(layout.names, layout.dtypes, arrays):
+            data=np.ascontiguousarray(arr).view(np.uint8).reshape(-1)
+            if data.nbytes<self.minbytes or self.skip.get(name, 0)>0:
+                if name in self.skip:
+                    self.skip[name]-=1
+                encoded.append((CODEC_RAW, data))
+                continue
+            codec=self.codec
+            if dtype.itemsize>1:
+                data=shuffle(data, dtype.itemsize)
+                codec|=SHUFFLE
+            packed=_compress(self.codec, data)
+            if len(packed)>self.minratio*data.nbytes:
+                self.skip[name]=self.skipbatches
+                encoded.append((CODEC_RAW, np.ascontiguousarray(arr).view(np.uint8).reshape(-1)))
+                continue
+            encoded.append((codec, packed))
+            gained=True
+        if not gained:
+            self.nraw+=1
+            return None
+        self.nencoded+=1
+        return encoded
+
+def packedsize(encoded):
+    return _codechead.size*len(encoded)+sum(len(data) for codec,data in encoded)
+
+def pack(buf, payload, encoded):
+    pos=payload
+    for codec,data in encoded:
+        _codechead.pack_into(buf, pos, codec, len(data))
+        pos+=_codechead.size
+    for codec,data in encoded:
+        buf[pos:pos+len(data)]=np.frombuffer(data, dtype=np.uint8)
+        pos+=len(data)
+
+def decode(buf, payload, layout, out):
+    #decode an encoded payload into out, at the column offsets of layout
+    ncols=len(layout.names)
+    entries=[_codechead.unpack_from(buf, payload+icol*_codechead.size) for icol in range(ncols)]
+    pos=payload+_codechead.size*ncols
+    for (codec,length),dtype,off,nbytes in zip(entries, layout.dtypes, layout.offsets, layout.sizes):
+        data=buf[pos:pos+length]
+        pos+=length
+        if codec!=CODEC_RAW:
+            data=np.frombuffer(_decompress(codec & ~SHUFFLE, data.tobytes(), nbytes), dtype=np.uint8)
+            if codec & SHUFFLE:
+                data=unshuffle(data, dtype.itemsize).reshape(-1)
+        out[off:off+nbytes]=data
+
+def setup(codec='auto', **kwargs):
+    global default
+    default = batchcodec(codec, **kwargs)
+    return default
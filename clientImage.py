@@ -1,6 +1,7 @@
 import psana
 import numpy as np
 from mpidata import mpidata 
+import eventselection
 import RegDB.experiment_info
 
 import sys
@@ -71,6 +72,9 @@ def runclient(args):
     #vars_to_send.append(['tt__FLTPOSPS','tt__AMPL'])
     vars_to_send=[]
 
+    #one mpidata for the whole run so the batch layout is only registered once
+    md=mpidata()
+    selection=eventselection.fromfile()
     masterDict={}
     for nevent,evt in enumerate(ds.events()):
         if nevent == args.noe : break
@@ -83,24 +87,9 @@ def runclient(args):
         #event selection.
         ###
         #check that all required detectors are ok - this should ensure that we don't need to do any fancy event matching/filling at the cost of losing events.
-        if 'ipm2' in defData.keys() and defData['damage']['ipm2'] < 1:
+        #same rules as the workers: the event_selection section of smalldata_plot.yml.
+        if not selection(defData):
             continue
-        if 'ipm5' in defData.keys() and defData['damage']['ipm5'] < 1:
-            continue
-        if defData['damage']['evr0'] < 1:
-            continue
-
-        try:
-            if defData['damage']['tt'] < 1:
-                continue
-        except:
-            pass
-
-        try:
-            if defData['damage']['enc'] < 1:
-                continue
-        except:
-            pass
         
         #only now bother to deal with detector data to save time. 
         #for now, this will be empty and we will only look at defalt data
@@ -162,7 +151,6 @@ def runclient(args):
                     print 'send data, looked at %d events/rank, total ~ %d, run time %g, approximate rate %g from rank %d'%(nevent, nevent*(size-1), (time.time()-time0), nevent*(size-1)/(time.time()-time0), rank)
                 else:
                     print 'send data, looked at %d events/rank, total ~ %d, run time %g, approximate rate %g from rank %d'%(nevent, nevent*(size-1), (time.time()-time0), nevent/(time.time()-time0), rank)
-            md=mpidata()
             #I think add a list of keys of the data dictionary to the client.
             md.addarray('nEvts',np.array([nevent]))
             md.addarray('send_timeStamp', np.array(evt.get(psana.EventId).time()))
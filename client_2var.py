@@ -6,6 +6,7 @@ import time
 import socket
 
 import numpy as np
+from dataservice import localtail, requester
 import holoviews as hv
 import pandas as pd
 
@@ -100,6 +101,7 @@ class BokehApp:
         setupDict=yaml.load(open('smalldata_plot.yml','r'))
         self.master_port=setupDict['master']['port']
         self.master_server=setupDict['master']['server']
+        self.request_timeout=setupDict['master'].get('request_timeout', 5.)
         self.plotName=plotName
 
         self.updateRate=setupDict[self.plotName]['updateRate']
@@ -114,6 +116,7 @@ class BokehApp:
         self.data={self.var1:[]}
         self.data[self.var2]=[]
         # Initialize buffers
+        self.tail = localtail(self.number_of_events, [self.var1, self.var2, 'event_time'])
         self.streamData = hv.streams.Stream.define('df',df=pd.DataFrame(self.data))()
                     
     def produce_plot(self, context, doc, plotName):
@@ -132,8 +135,8 @@ class BokehApp:
         
         """
 
-        socket = context.socket(zmq.REQ)        
-        socket.connect("tcp://%s:%d" %(self.master_server,self.master_port))
+        #retries on a fresh socket if the master does not answer in time
+        server = requester(context, "tcp://%s:%d" %(self.master_server,self.master_port), self.request_timeout)
         
         gen_Plot = my_partial(gen_plot_scat, xRange=self.xRange, yRange=self.yRange, nomSize=self.plot_width/100.)
         plotScat = hv.DynamicMap(gen_Plot, streams=[self.streamData]).options(width=self.plot_width, height=self.plot_height)
@@ -147,12 +150,15 @@ class BokehApp:
             Push data to correlation graph
             
             """
-            socket.send_string("Request_%s"%self.plotName.replace(' ','_'))
             nowStr = time.strftime("%b %d %Y %H:%M:%S", time.localtime())
             print("correlation plot %s requested data at %s, plot %g seconds "%(self.plotName,nowStr,time.time()-self.plotStartTime))
 
             print '*** waiting'
-            data_dict = socket.recv_pyobj()
+            #ask only for the rows appended since the last update
+            reply = server.request(self.tail.request())
+            if reply is None:
+                return
+            data_dict = self.tail.update(reply)
             print '*** received'
 
             pdSeriesDict={}
@@ -1,5 +1,6 @@
 import sys
 import zmq
+import zmqcodec
 import traceback
 import yaml
 import time
@@ -151,7 +152,7 @@ class BokehApp:
             nowStr = time.strftime("%b %d %Y %H:%M:%S", time.localtime())
             print("correlation plot %s requested data at %s, plot %g seconds "%(self.plotName,nowStr,time.time()-self.plotStartTime))
 
-            data_dict = socket.recv_pyobj()
+            data_dict = zmqcodec.recvdict(socket)
 
             pdSeriesDict={}
 
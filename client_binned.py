@@ -6,6 +6,7 @@ import time
 import socket
 
 import numpy as np
+from dataservice import scanrequest, requester
 import holoviews as hv
 import pandas as pd
 
@@ -100,6 +101,7 @@ class BokehApp:
         setupDict=yaml.load(open('smalldata_plot.yml','r'))
         self.master_port=setupDict['master']['port']
         self.master_server=setupDict['master']['server']
+        self.request_timeout=setupDict['master'].get('request_timeout', 5.)
         self.plotName=plotName
 
         self.updateRate=setupDict[self.plotName]['updateRate']
@@ -114,7 +116,6 @@ class BokehApp:
         self.data={'scanSteps':[]}
         self.data['scanValues_on']=[]
         #self.data['scanValues_off']=[]
-        # Initialize buffers
         self.streamData = hv.streams.Stream.define('df',df=pd.DataFrame(self.data))()
                     
     def produce_plot(self, context, doc, plotName):
@@ -133,8 +134,8 @@ class BokehApp:
         
         """
 
-        socket = context.socket(zmq.REQ)        
-        socket.connect("tcp://%s:%d" %(self.master_server,self.master_port))
+        #retries on a fresh socket if the master does not answer in time
+        server = requester(context, "tcp://%s:%d" %(self.master_server,self.master_port), self.request_timeout)
         
         gen_Plot = my_partial(gen_plot_scat, xRange=self.xRange, yRange=self.yRange, nomSize=self.plot_width/100.)
         plotScat = hv.DynamicMap(gen_Plot, streams=[self.streamData]).options(width=self.plot_width, height=self.plot_height)
@@ -148,44 +149,23 @@ class BokehApp:
             Push data to correlation graph
             
             """
-            socket.send_string("Request_%s"%self.plotName.replace(' ','_'))
             nowStr = time.strftime("%b %d %Y %H:%M:%S", time.localtime())
             print("correlation plot %s requested data at %s, plot %g seconds "%(self.plotName,nowStr,time.time()-self.plotStartTime))
 
-            data_dict = socket.recv_pyobj()
-
-            pdSeriesDict={}
-
-            # FIX ME: why this?
-            # Get time from data_dict
-            print("total time data: ", data_dict['event_time'][0], data_dict['event_time'][-1])
-            timeData = data_dict['event_time'][-self.number_of_events:]
-            modTimeData = timeData[:,0]+ (timeData[:,1]*1e-6).astype(int)*1e-3
-
-            print("got data starting at: ", modTimeData[0], len(modTimeData))
-            #get all relevant fields
-            scanVarName=''
-            for key in data_dict.keys():
-                if key.find('scan')>=0:
-                    scanVarName=key
-            i0 = data_dict[self.i0var]
-            sig = data_dict[self.sigvar]
-            laser = data_dict['lightStatus__laser']
-            xray = data_dict['lightStatus__xray']
-
-            i0=i0[xray>0]
-            sig=sig[xray>0]
-            
-            i0_on=i0[laser>0]
-            i0_off=i0[laser==0]
-            sig_on=sig[laser>0]
-            sig_off=sig[laser==0]
-
-            for key in self.data.keys():
-                pdSeriesDict[key]= pd.Series(
-                     data_dict[key][-self.number_of_events:],
-                     index=modTimeData)
-            full_frame = pd.DataFrame(pdSeriesDict)
+            #the master keeps the binned sums of this scan, we only get those
+            reply = server.request(scanrequest(self.plotName))
+            if reply is None:
+                return
+            if 'error' in reply:
+                print(reply['error'])
+                return
+
+            print("binned %s: %d events in %d bins"%(reply['scanVar'], reply['nEvts'], len(reply['scanPoints'])))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratio_on = reply['sig_on']/reply['i0_on']
+            self.data['scanSteps'] = reply['scanPoints']
+            self.data['scanValues_on'] = ratio_on
+            full_frame = pd.DataFrame(self.data)
 
             self.streamData.event(df=full_frame)
                     
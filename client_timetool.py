@@ -5,6 +5,7 @@ import yaml
 import time
 
 import numpy as np
+from dataservice import localtail, requester, windowrequest
 import holoviews as hv
 import pandas as pd
 
@@ -95,6 +96,7 @@ class BokehApp:
         setupDict=yaml.load(open('smalldata_plot.yml','r'))
         self.master_port=setupDict['master']['port']
         self.master_server=setupDict['master']['server']
+        self.request_timeout=setupDict['master'].get('request_timeout', 5.)
         self.plotName=plotName
 
         self.updateRate=setupDict[self.plotName]['updateRate']
@@ -102,10 +104,13 @@ class BokehApp:
         self.plot_width=setupDict[self.plotName]['width']
         self.plot_height=setupDict[self.plotName]['height']
         self.yRange=setupDict[self.plotName]['yRange']
+        #optional: plot the last timeWindow seconds instead of the last number_of_events events
+        self.timeWindow=setupDict[self.plotName].get('timeWindow')
 
         self.var1='tt__FLTPOS'
         self.data={self.var1:[]}
         # Initialize buffers
+        self.tail = localtail(self.number_of_events, [self.var1, 'event_time'])
         self.streamData = hv.streams.Stream.define('df',df=pd.DataFrame(self.data))()
                     
     def produce_plot(self, context, doc, plotName):
@@ -124,8 +129,8 @@ class BokehApp:
         
         """
 
-        socket = context.socket(zmq.REQ)        
-        socket.connect("tcp://%s:%d" %(self.master_server,self.master_port))
+        #retries on a fresh socket if the master does not answer in time
+        server = requester(context, "tcp://%s:%d" %(self.master_server,self.master_port), self.request_timeout)
         
         # Note: Cannot name 'timetool' variables in hvTimeTool and hvIpmAmp the same thing
         # Otherwise, holoviews will try to sync the axis and throw off the ranges for the plots
@@ -144,11 +149,18 @@ class BokehApp:
             Push data to timetool time history graph
             
             """
-            socket.send_string("Request_%s"%self.plotName.replace(' ','_'))
             nowStr = time.strftime("%b %d %Y %H:%M:%S", time.localtime())
             print("Timetool requested data at %s, plot %g seconds "%(nowStr,time.time()-self.plotStartTime))
 
-            data_dict = socket.recv_pyobj()
+            if self.timeWindow is not None:
+                #the master looks up the time range in its sorted event_time index
+                data_dict = server.request(windowrequest(self.timeWindow, names=[self.var1, 'event_time'], tail=self.number_of_events))
+            else:
+                #ask only for the rows appended since the last update
+                reply = server.request(self.tail.request())
+                data_dict = None if reply is None else self.tail.update(reply)
+            if data_dict is None:
+                return
 
             pdSeriesDict={}
 
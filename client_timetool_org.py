@@ -1,5 +1,6 @@
 import sys
 import zmq
+import zmqcodec
 import traceback
 import yaml
 
@@ -131,7 +132,7 @@ class BokehApp:
             nowStr = time.strftime("%b %d %Y %H:%M:%S", time.localtime())
             print("Timetool requested data at %s, plot %g seconds "%(nowStr,time.time()-self.plotStartTime))
 
-            data_dict = socket.recv_pyobj()
+            data_dict = zmqcodec.recvdict(socket)
 
             timetool_d = deque(maxlen=self.number_of_events)
             timetool_t = deque(maxlen=self.number_of_events)
@@ -162,7 +163,7 @@ class BokehApp:
             socket.send_string("Request_%s"%self.plotName.replace(' ','_'))
             nowStr = time.strftime("%b %d %Y %H:%M:%S", time.localtime())
             print("Timetool ampl-ipm requested data at %s, plot %g seconds "%(nowStr,time.time()-self.plotStartTime))
-            data_dict = socket.recv_pyobj()
+            data_dict = zmqcodec.recvdict(socket)
         
             timetool_d = deque(maxlen=self.number_of_events)
             ipm_d = deque(maxlen=self.number_of_events)
@@ -183,7 +184,7 @@ class BokehApp:
             socket.send_string("Request_%s"%self.plotName.replace(' ','_'))
             nowStr = time.strftime("%b %d %Y %H:%M:%S", time.localtime())
             print("Timetool corr_time requested data at %s, plot %g seconds "%(nowStr,time.time()-self.plotStartTime))
-            data_dict = socket.recv_pyobj()
+            data_dict = zmqcodec.recvdict(socket)
         
             timetool_d = deque(maxlen=self.number_of_events)
             timetool_t = deque(maxlen=self.number_of_events)
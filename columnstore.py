@@ -0,0 +1,503 @@
+import os
+import json
+import time
+import numpy as np
+from threading import Lock
+
+#batches and events a sender has dropped so far under flow control
+DROPMETA=('nBatches_dropped','nEvts_dropped')
+#per-batch bookkeeping the workers add to each batch: one entry per batch, not
+#per event, so it is not kept in the event columns.
+BATCHMETA=('nEvts','nEvts_sent','send_timeStamp')+DROPMETA
+#metadata of a columnstore kept in files: schemas, write position, run number
+METAFILE='columnstore.json'
+
+def batchkey(columns):
+    #layout of the event columns of a batch given as [(name, array)], whatever its length
+    return tuple((name, arr.dtype.str, arr.shape[1:]) for name,arr in columns if name not in BATCHMETA)
+
+def batchevents(columns, indexcol='event_time'):
+    for name,arr in columns:
+        if name==indexcol:
+            return arr.shape[0]
+    return 0
+
+def mergebatches(batchlist):
+    """
+    concatenate the event columns of batches with the same layout. The per-batch
+    columns keep the last value, except nEvts_sent which is summed.
+    """
+    merged=[]
+    for name,arr in batchlist[0]:
+        arrays=[dict(columns)[name] for columns in batchlist]
+        if name=='nEvts_sent':
+            merged.append((name, np.sum(arrays, axis=0)))
+        elif name in BATCHMETA:
+            merged.append((name, arrays[-1]))
+        else:
+            merged.append((name, np.concatenate(arrays, axis=0)))
+    return merged
+
+def thinbatch(columns, step=2):
+    #keep every step-th event of a batch. Returns the batch and the number of events left out.
+    n=batchevents(columns)
+    kept=len(range(0, n, step))
+    thinned=[]
+    for name,arr in columns:
+        if name=='nEvts_sent':
+            arr=np.array([kept])
+        elif name not in BATCHMETA:
+            arr=np.ascontiguousarray(arr[::step])
+        thinned.append((name, arr))
+    return thinned, n-kept
+
+def fillvalue(dtype):
+    #value of rows without data: NaN for floats, so they are not plotted or binned
+    return np.nan if np.dtype(dtype).kind in 'fc' else 0
+
+def eventns(times):
+    #event_time as int64 nanoseconds: (seconds, nanoseconds) rows, or seconds
+    times=np.asarray(times)
+    if times.ndim==2 and times.shape[1]==2:
+        return times[:,0].astype(np.int64)*1000000000+times[:,1].astype(np.int64)
+    if times.dtype.kind=='f':
+        return np.round(times*1e9).astype(np.int64)
+    return times.astype(np.int64)
+
+class timeindex(object):
+    """
+    event times (int64 ns) of the rows of a store, sorted, with the row of
+    each. Batches of different ranks come in out of order: add() only queues
+    them (sorted) and the queue is merged in one go once it holds mergerows
+    rows. Rows that have left the ring buffers are dropped at a merge once
+    there are as many of them as capacity.
+    A timeindex is never changed: add() returns a new one, so readers can
+    use the one they got while the store moves on.
+    """
+    def __init__(self, capacity, mergerows=None, times=None, rows=None, pending=()):
+        self.capacity = capacity
+        self.mergerows = max(1, capacity//16) if mergerows is None else mergerows
+        self.times = np.zeros(0, dtype=np.int64) if times is None else times
+        self.rows = np.zeros(0, dtype=np.int64) if rows is None else rows
+        #(times, rows) of the batches not merged yet, each sorted by time
+        self.pending = pending
+
+    def add(self, times, start):
+        #index with the times of the rows start, start+1, ... added
+        order=np.argsort(times, kind='mergesort')
+        pending=self.pending+((times[order], start+order.astype(np.int64)),)
+        if sum(len(t) for t,r in pending)<self.mergerows:
+            return timeindex(self.capacity, self.mergerows, self.times, self.rows, pending)
+        times=np.concatenate([t for t,r in pending])
+        rows=np.concatenate([r for t,r in pending])
+        order=np.argsort(times, kind='mergesort')
+        times=times[order]
+        rows=rows[order]
+        if len(self.times)==0 or times[0]>=self.times[-1]:
+            #nothing late: the usual case
+            times=np.concatenate([self.times, times])
+            rows=np.concatenate([self.rows, rows])
+        else:
+            pos=np.searchsorted(self.times, times, side='right')
+            times=np.insert(self.times, pos, times)
+            rows=np.insert(self.rows, pos, rows)
+        if len(rows)>2*self.capacity:
+            live=rows>=rows.max()+1-self.capacity
+            times=times[live]
+            rows=rows[live]
+        return timeindex(self.capacity, self.mergerows, times, rows)
+
+    def window(self, t0, t1, minrow):
+        """
+        rows with t0<=time<t1 (either may be None for no limit) that are at
+        least minrow, in time order.
+        """
+        times=[]
+        rows=[]
+        for t,r in ((self.times, self.rows),)+self.pending:
+            lo=0 if t0 is None else np.searchsorted(t, t0, side='left')
+            hi=len(t) if t1 is None else np.searchsorted(t, t1, side='left')
+            times.append(t[lo:hi])
+            rows.append(r[lo:hi])
+        rows=np.concatenate(rows)
+        if len(self.pending)>0:
+            rows=rows[np.argsort(np.concatenate(times), kind='mergesort')]
+        return rows[rows>=minrow]
+
+    def newest(self, minrow):
+        #latest time of the rows from minrow on, None if there are none
+        newest=None
+        for t,r in ((self.times, self.rows),)+self.pending:
+            for i in range(len(r)-1, -1, -1):
+                if r[i]>=minrow:
+                    if newest is None or t[i]>newest:
+                        newest=t[i]
+                    break
+        return newest
+
+class ringcolumn(object):
+    """
+    fixed capacity circular buffer for one variable.
+    Every row is written twice (at i and i+capacity) so any window of up to
+    capacity rows is a single contiguous slice and tail() never copies.
+    With a path the buffer is a memory mapped file, created unless create is
+    False.
+    """
+    def __init__(self, capacity, rowshape, dtype, path=None, create=True):
+        self.capacity = capacity
+        self.rowshape = tuple(rowshape)
+        self.dtype = np.dtype(dtype)
+        if path is None:
+            self.data = np.full((2*capacity,)+self.rowshape, fillvalue(self.dtype), dtype=self.dtype)
+        else:
+            self.data = np.memmap(path, dtype=self.dtype, mode='w+' if create else 'r+', shape=(2*capacity,)+self.rowshape)
+            if create:
+                self.data[:]=fillvalue(self.dtype)
+
+    def matches(self, rows):
+        return rows.shape[1:]==self.rowshape and rows.dtype==self.dtype
+
+    def write(self, start, rows):
+        #start: global row index of the first row
+        n=rows.shape[0]
+        if n>self.capacity:
+            start+=n-self.capacity
+            rows=rows[-self.capacity:]
+            n=self.capacity
+        pos=start%self.capacity
+        first=min(n, self.capacity-pos)
+        self.data[pos:pos+first]=rows[:first]
+        self.data[pos+self.capacity:pos+self.capacity+first]=rows[:first]
+        if n>first:
+            self.data[:n-first]=rows[first:]
+            self.data[self.capacity:self.capacity+n-first]=rows[first:]
+
+    def fill(self, start, n, value=None):
+        #used for rows of a batch that did not have this variable
+        if value is None:
+            value=fillvalue(self.dtype)
+        n=min(n, self.capacity)
+        pos=start%self.capacity
+        first=min(n, self.capacity-pos)
+        self.data[pos:pos+first]=value
+        self.data[pos+self.capacity:pos+self.capacity+first]=value
+        if n>first:
+            self.data[:n-first]=value
+            self.data[self.capacity:self.capacity+n-first]=value
+
+    def tail(self, end, n):
+        #view of the n rows before global row index end
+        start=(end-n)%self.capacity
+        return self.data[start:start+n]
+
+    def take(self, rows):
+        #copy of the rows at the global row indices rows, all still in the buffer
+        return self.data[rows%self.capacity]
+
+class storeview(object):
+    """
+    one version of a columnstore as the request threads see it: the row
+    count, the columns, the per-batch values and the time index of that
+    version. The ring buffers are shared with the store, so rows older than
+    nrows-capacity may be overwritten while they are read; columnstore checks
+    for that afterwards. The read methods return the data and the first row
+    they read.
+    """
+    def __init__(self, store):
+        self.capacity = store.capacity
+        self.epoch = store.epoch
+        self.nrows = store.nrows
+        self.first = store.first
+        self.version = store.version
+        self.runNumber = store.runNumber
+        self.columns = store.columns
+        self.meta = dict(store.meta)
+        self.index = store.index
+
+    def __len__(self):
+        return min(self.nrows-self.first, self.capacity)
+
+    def tail(self, name, n=None):
+        nrows=len(self)
+        if n is None or n>nrows:
+            n=nrows
+        return self.columns[name].tail(self.nrows, n)
+
+    def _dict(self, columns):
+        data=dict(columns)
+        data.update(self.meta)
+        data['runNumber']=self.runNumber
+        data['seq']=(self.epoch, self.nrows)
+        return data
+
+    def todict(self, n=None, names=None):
+        if names is None:
+            names=list(self.columns.keys())
+        if n is None or n>len(self):
+            n=len(self)
+        data=self._dict((name, self.tail(name, n).copy()) for name in names if name in self.columns)
+        return data, self.nrows-n
+
+    def newrows(self, epoch, nrows, n=None):
+        #number of rows after (epoch, nrows) for delta, None if the caller has to start over
+        maxrows=self.capacity if n is None else min(n, self.capacity)
+        if epoch==self.epoch and nrows<=self.nrows and self.nrows-nrows<=maxrows:
+            return self.nrows-nrows
+        return None
+
+    def delta(self, epoch, nrows, names=None, n=None):
+        new=self.newrows(epoch, nrows, n)
+        data,first=self.todict(n if new is None else new, names)
+        data['reset']=new is None
+        return data, first
+
+    def window(self, t0=None, t1=None, last=None, names=None, n=None):
+        minrow=self.nrows-len(self)
+        if last is not None:
+            newest=self.index.newest(minrow)
+            if newest is None:
+                t0,t1=0,0
+            else:
+                t0,t1=newest-int(last*1e9),newest+1
+        rows=self.index.window(t0, t1, minrow)
+        if n is not None:
+            rows=rows[len(rows)-min(n, len(rows)):]
+        if names is None:
+            names=list(self.columns.keys())
+        data=self._dict((name, self.columns[name].take(rows)) for name in names if name in self.columns)
+        data['reset']=True
+        return data, rows.min() if len(rows)>0 else self.nrows
+
+class columnstore(object):
+    """
+    bounded store of the most recent events for the master.
+    Each variable lives in a preallocated ringcolumn of `capacity` rows, so
+    appending a batch costs only the new rows. nrows counts all rows appended
+    since the last clear(); tail(name, n) is a view on the last n rows.
+    (epoch, nrows) is the sequence number of the newest row: epoch counts the
+    clears, so a client can ask for the rows after the last one it has seen.
+    version changes with every append or clear.
+    The rows are kept in the order they came in; the index column is also
+    kept sorted in a timeindex for window().
+
+    There is one writer (the master loop) and any number of reader threads.
+    Readers do not take a lock: append and clear publish a new storeview
+    once a batch is completely applied, readers copy from the view they got,
+    and read again from the newest one if an append overwrote rows under
+    them meanwhile (a seqlock). The lock only keeps writers apart.
+
+    With a path, the ring buffers are memory mapped files in that directory
+    and METAFILE there is rewritten when the columns or the epoch change,
+    every saverows rows (default capacity/8) and every saveinterval seconds.
+    A new store on the same path picks up the rows a previous master left (a
+    warm restart), with a new epoch so the clients start over once. The rows
+    written since METAFILE was saved are lost then, and as many of the oldest
+    rows are dropped, as they may have been overwritten.
+    """
+    def __init__(self, capacity, indexcol='event_time', metacols=BATCHMETA, path=None, saverows=None, saveinterval=1.):
+        self.capacity = capacity
+        self.indexcol = indexcol
+        self.metacols = metacols
+        self.path = path
+        self.runNumber = -1
+        self.epoch = -1
+        self.version = 0
+        #column name -> file name of its buffer, when kept in files
+        self.files = {}
+        self.serial = 0
+        self.maxbatch = 0
+        self.saverows = max(capacity//8, 1) if saverows is None else saverows
+        self.saveinterval = saveinterval
+        #nrows and time of the last save of METAFILE
+        self.savedrows = 0
+        self.savedtime = 0.
+        self.lock = Lock()
+        if path is not None and not os.path.isdir(path):
+            os.makedirs(path)
+        if path is None or not self._load():
+            self.clear()
+
+    def clear(self, runNumber=None):
+        with self.lock:
+            #new ring buffers: views of the old ones stay intact
+            oldfiles = list(self.files.values())
+            self.columns = {}
+            self.files = {}
+            self.meta = {}
+            self.nrows = 0
+            self.first = 0
+            self.index = timeindex(self.capacity)
+            self.epoch += 1
+            self.version += 1
+            if runNumber is not None:
+                self.runNumber = runNumber
+            self.writing = (self.epoch, 0)
+            self.view = storeview(self)
+            if self.path is not None:
+                self._save()
+                #readers may still map them, the data goes once they are done
+                for filename in oldfiles:
+                    os.remove(os.path.join(self.path, filename))
+
+    def _newcolumn(self, name, rowshape, dtype):
+        if self.path is None:
+            return ringcolumn(self.capacity, rowshape, dtype)
+        filename='col%d.dat'%self.serial
+        self.serial+=1
+        oldfile=self.files.get(name)
+        self.files[name]=filename
+        col=ringcolumn(self.capacity, rowshape, dtype, os.path.join(self.path, filename))
+        if oldfile is not None:
+            os.remove(os.path.join(self.path, oldfile))
+        return col
+
+    def _save(self):
+        meta={'capacity': self.capacity, 'indexcol': self.indexcol,
+              'epoch': self.epoch, 'nrows': self.nrows, 'first': self.first,
+              'runNumber': self.runNumber, 'serial': self.serial, 'maxbatch': self.maxbatch,
+              'saverows': self.saverows,
+              'columns': dict((name, [self.files[name], col.dtype.str, list(col.rowshape)]) for name,col in self.columns.items()),
+              'meta': dict((name, [arr.dtype.str, arr.tolist()]) for name,arr in self.meta.items())}
+        filename=os.path.join(self.path, METAFILE)
+        with open(filename+'.tmp', 'w') as f:
+            json.dump(meta, f)
+        #the old metadata stays whole until the new one is complete
+        os.rename(filename+'.tmp', filename)
+        self.savedrows=self.nrows
+        self.savedtime=time.time()
+
+    def _load(self):
+        #pick up the store left in path, False if there is none we can use
+        filename=os.path.join(self.path, METAFILE)
+        if not os.path.exists(filename):
+            return False
+        try:
+            with open(filename) as f:
+                meta=json.load(f)
+            if meta['capacity']!=self.capacity or meta['indexcol']!=self.indexcol:
+                print('columnstore: %s holds a store of %d rows, starting empty'%(self.path, meta['capacity']))
+                return False
+            columns={}
+            for name,(colfile,dtype,rowshape) in meta['columns'].items():
+                columns[name]=ringcolumn(self.capacity, rowshape, dtype, os.path.join(self.path, colfile), create=False)
+        except (IOError, OSError, ValueError, KeyError) as e:
+            print('columnstore: cannot pick up the store in %s, starting empty: %s'%(self.path, e))
+            return False
+        self.columns=columns
+        self.files=dict((name, value[0]) for name,value in meta['columns'].items())
+        self.meta=dict((name, np.array(values, dtype=dtype)) for name,(dtype,values) in meta['meta'].items())
+        self.nrows=meta['nrows']
+        self.serial=meta['serial']
+        self.maxbatch=meta['maxbatch']
+        self.runNumber=meta['runNumber']
+        self.epoch=meta['epoch']+1
+        self.version+=1
+        #the rows written after the last save, at most saverows plus the batch
+        #being written when the old master died, may have overwritten as many
+        #of the oldest rows
+        self.first=min(max(meta['first'], self.nrows-self.capacity+meta.get('saverows', 0)+self.maxbatch), self.nrows)
+        self.index=timeindex(self.capacity)
+        self.writing=(self.epoch, self.nrows)
+        self.view=storeview(self)
+        n=len(self)
+        if n>0 and self.indexcol in self.columns:
+            self.index=self.index.add(eventns(self.view.tail(self.indexcol, n)), self.nrows-n)
+            self.view=storeview(self)
+        self._save()
+        print('columnstore: picked up %d rows of run %d from %s'%(n, self.runNumber, self.path))
+        return True
+
+    def keys(self):
+        return self.columns.keys()
+
+    def __len__(self):
+        return min(self.nrows-self.first, self.capacity)
+
+    def append(self, columns):
+        """
+        append one batch given as a list of (name, array). All event columns
+        need the same number of rows as the index column; the per-batch
+        columns in metacols only keep their last value.
+        """
+        columns=dict(columns)
+        if self.indexcol not in columns:
+            print('columnstore: batch without %s, skipping it'%self.indexcol)
+            return 0
+        with self.lock:
+            n=columns[self.indexcol].shape[0]
+            start=self.nrows
+            newcolumns=False
+            written=set()
+            #from here on the rows before start+n-capacity may be overwritten
+            self.writing=(self.epoch, start+n)
+            self.maxbatch=max(self.maxbatch, min(n, self.capacity))
+            for name,rows in columns.items():
+                if name in self.metacols:
+                    self.meta[name]=np.array(rows)
+                    continue
+                if rows.shape[0]!=n:
+                    print('We are out of alignment for %s '%name, rows.shape[0], n)
+                    continue
+                col=self.columns.get(name)
+                if col is None or not col.matches(rows):
+                    if col is not None:
+                        print('columnstore: %s changed shape or type, dropping its history'%name)
+                    col=self._newcolumn(name, rows.shape[1:], rows.dtype)
+                    newcolumns=True
+                    #the published views keep the old dict
+                    self.columns=dict(self.columns)
+                    self.columns[name]=col
+                col.write(start, rows)
+                written.add(name)
+            #also the misaligned ones: their slots still hold rows from capacity rows ago
+            for name,col in self.columns.items():
+                if name not in written:
+                    col.fill(start, n)
+            self.index=self.index.add(eventns(columns[self.indexcol]), start)
+            self.nrows+=n
+            self.version+=1
+            self.view=storeview(self)
+            #the new column files have to be in METAFILE before a restart
+            if self.path is not None and (newcolumns or self.nrows-self.savedrows>=self.saverows or time.time()-self.savedtime>=self.saveinterval):
+                self._save()
+        return n
+
+    def snapshot(self):
+        #the current storeview; pass it to the read methods to read one version
+        return self.view
+
+    def _read(self, view, read):
+        if view is None:
+            view=self.view
+        while True:
+            data,first=read(view)
+            epoch,written=self.writing
+            if epoch==view.epoch and first>=written-self.capacity:
+                return data
+            #an append overwrote rows we read, or the store was cleared
+            view=self.view
+
+    def tail(self, name, n=None):
+        #view on the ring buffer: only for the writer's thread
+        return self.view.tail(name, n)
+
+    def todict(self, n=None, names=None, view=None):
+        #copy of the last n rows of every column (or of those in names), in the layout of the old master dict
+        return self._read(view, lambda v: v.todict(n, names))
+
+    def delta(self, epoch, nrows, names=None, n=None, view=None):
+        """
+        the rows appended after sequence number (epoch, nrows), as todict.
+        reset is set when those rows do not continue the caller's: the store
+        has been cleared since or more than capacity (or n) rows are new. The
+        reply then holds the last n rows and replaces what the caller had.
+        """
+        return self._read(view, lambda v: v.delta(epoch, nrows, names, n))
+
+    def window(self, t0=None, t1=None, last=None, names=None, n=None, view=None):
+        """
+        the rows with t0<=event time<t1 (int64 ns, as eventns) in time order,
+        or with last: those of the last `last` seconds up to the newest event.
+        At most the last n of them; otherwise as todict, with reset set.
+        """
+        return self._read(view, lambda v: v.window(t0, t1, last, names, n))
@@ -0,0 +1,354 @@
+import json
+import time
+from collections import OrderedDict
+from threading import Thread, Lock
+import numpy as np
+import zmq
+from columnstore import BATCHMETA
+import zmqcodec
+
+#
+# request protocol of the master's data service. A client sends a JSON dict:
+#   {"columns": [names],        only these columns (default: all)
+#    "tail": n,                 at most the last n rows (default: all kept)
+#    "since": [epoch, nrows]}   the sequence number of the newest row it has
+# and gets back (a dict, framed by zmqcodec) only the rows appended since then,
+# with 'seq' (the new sequence number to ask from next time) and 'reset'
+# (True: the rows replace everything the client had, e.g. after a new run).
+# With "window": [t0, t1] (event times in seconds) or "last": T (the T seconds
+# up to the newest event) instead of "since", the reply holds the rows in that
+# time range, sorted by event time, and always replaces what the client had.
+# Every key is optional; the old "Request_<plotName>" strings get the whole
+# store. {"scan": name} instead asks for the binned sums the master keeps for
+# the scan section name of the setup (see scanbinning). A request that cannot
+# be answered gets {"error": message}.
+#
+# Several plots polling between two ingests ask for the same rows, so the
+# encoded replies are cached by (store version, columns, tail, rows since).
+# Replies are read from a snapshot of the store without blocking the ingest.
+#
+# serve() answers on a ROUTER socket with a pool of worker threads behind an
+# inproc DEALER, so one slow client does not hold up the others. Plain REQ
+# clients work unchanged; requester adds a timeout and retries on top.
+#
+# Without requests, publisher sends the new rows on a PUB socket on its own
+# timer, one topic per column; topictail collects them on a SUB socket.
+#
+
+def parserequest(message):
+    #request dict for a raw request message, {} for the old free text requests
+    if message[:1]!=b'{':
+        return {}
+    try:
+        request=json.loads(message.decode('utf-8'))
+    except ValueError:
+        print('dataservice: cannot parse request %r'%message[:100])
+        return {}
+    return request if isinstance(request, dict) else {}
+
+class responsecache(object):
+    """
+    least recently used cache of encoded replies, at most maxsize of them.
+    hits and misses count the lookups. Shared by the worker threads of serve,
+    so get and put take a lock.
+    """
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            frames=self.entries.pop(key, None)
+            if frames is None:
+                self.misses+=1
+                return None
+            self.entries[key]=frames
+            self.hits+=1
+            return frames
+
+    def put(self, key, frames):
+        with self.lock:
+            self.entries[key]=frames
+            while len(self.entries)>self.maxsize:
+                self.entries.popitem(last=False)
+
+def windowrequest(last=None, window=None, names=None, tail=None):
+    #request for the rows of the last `last` seconds, or of window=[t0, t1]
+    request={}
+    if last is not None:
+        request['last']=last
+    if window is not None:
+        request['window']=list(window)
+    if names is not None:
+        request['columns']=list(names)
+    if tail is not None:
+        request['tail']=tail
+    return json.dumps(request).encode('utf-8')
+
+def _seconds(t):
+    return None if t is None else int(round(float(t)*1e9))
+
+def scanrequest(name):
+    return json.dumps({'scan': name}).encode('utf-8')
+
+def _scanreply(scans, name, cache=None):
+    scan=(scans or {}).get(name)
+    if scan is None:
+        return zmqcodec.encode({'error': 'no binned scan %s on the master'%name})
+    key=('scan', name, scan.version)
+    frames=cache.get(key) if cache is not None else None
+    if frames is None:
+        data=scan.result()
+        frames=zmqcodec.encode(data)
+        if cache is not None:
+            cache.put(('scan', name, data['version']), frames)
+    return frames
+
+def reply(store, message, cache=None, scans=None):
+    """
+    the reply to a request message, as zmqcodec frames. With a cache,
+    identical requests on the same store version share one encoded reply.
+    scans: name -> scanbinner for the scan requests.
+    """
+    request=parserequest(message)
+    if 'scan' in request:
+        return _scanreply(scans, request['scan'], cache)
+    names=request.get('columns')
+    if names is not None:
+        names=tuple(names)
+    n=request.get('tail')
+    if n is not None:
+        n=int(n)
+    since=request.get('since')
+    #one version of the store for the cache key and the rows. Reading does
+    #not hold up the ingest; if the rows had to be read again from a newer
+    #version the reply is not cached under this key.
+    view=store.snapshot()
+    if 'window' in request or 'last' in request:
+        t0,t1=request.get('window') or (None, None)
+        t0,t1=_seconds(t0),_seconds(t1)
+        last=request.get('last')
+        key=(view.version, names, n, 'window', t0, t1, last)
+        read=lambda: store.window(t0, t1, last, names, n, view)
+    elif since is None:
+        key=(view.version, names, n, -1)
+        read=lambda: store.todict(n, names, view)
+    else:
+        epoch,nrows=int(since[0]),int(since[1])
+        key=(view.version, names, n, view.newrows(epoch, nrows, n))
+        read=lambda: store.delta(epoch, nrows, names, n, view)
+    frames=cache.get(key) if cache is not None else None
+    if frames is None:
+        data=read()
+        frames=zmqcodec.encode(data)
+        if cache is not None and tuple(data['seq'])==(view.epoch, view.nrows):
+            cache.put(key, frames)
+    return frames
+
+class localtail(object):
+    """
+    client side copy of the last n rows of the master's columns (or only of
+    those in names), kept up to date with the delta replies. request() is the
+    message to send, update() merges the reply and returns the local columns
+    in the layout of the old master dict.
+    """
+    def __init__(self, n, names=None):
+        self.n = n
+        self.names = names
+        self.seq = None
+        self.data = {}
+
+    def request(self):
+        request={'tail': self.n}
+        if self.names is not None:
+            request['columns']=list(self.names)
+        if self.seq is not None:
+            request['since']=list(self.seq)
+        return json.dumps(request).encode('utf-8')
+
+    def update(self, reply):
+        seq=reply.pop('seq', None)
+        reset=reply.pop('reset', True)
+        if reset:
+            self.data={}
+        resync=False
+        for name,value in reply.items():
+            if name in BATCHMETA or not isinstance(value, np.ndarray) or value.ndim==0:
+                self.data[name]=value
+                continue
+            local=self.data.get(name)
+            if local is not None and local.shape[1:]==value.shape[1:] and local.dtype==value.dtype:
+                self.data[name]=np.concatenate([local, value])[-self.n:]
+            else:
+                #a new or changed column: its history is on the master, ask for all of it next time
+                self.data[name]=value[-self.n:]
+                resync=not reset
+        self.seq=None if resync else seq
+        return self.data
+
+def _worker(context, store, cache, scans):
+    socket=context.socket(zmq.REP)
+    socket.connect('inproc://dataservice')
+    while True:
+        message=socket.recv()
+        #a bad request gets an error reply: the REQ client waits for one and
+        #the thread has to stay for the next requests
+        try:
+            frames=reply(store, message, cache, scans)
+        except Exception as e:
+            print('dataservice: cannot answer request %r: %r'%(message[:100], e))
+            frames=zmqcodec.encode({'error': 'cannot answer request %r: %r'%(message[:100], e)})
+        print('dataservice: request %r, %d columns, cache hits %d misses %d'%(message[:100], len(frames)-1, cache.hits, cache.misses))
+        socket.send_multipart(frames, copy=False)
+
+def serve(store, port, nthreads=4, cachesize=32, sndhwm=10, scans=None):
+    """
+    answer requests for store (and the binned scans) on port with nthreads
+    worker threads. Replies to a client that stopped reading are dropped once
+    sndhwm of them are queued. Does not return: run it in its own thread.
+    """
+    context=zmq.Context.instance()
+    frontend=context.socket(zmq.ROUTER)
+    frontend.setsockopt(zmq.SNDHWM, sndhwm)
+    frontend.bind('tcp://*:%s'%port)
+    backend=context.socket(zmq.DEALER)
+    backend.bind('inproc://dataservice')
+    cache=responsecache(cachesize)
+    for ithread in range(nthreads):
+        thr=Thread(target=_worker, args=(context, store, cache, scans))
+        thr.daemon=True
+        thr.start()
+    zmq.proxy(frontend, backend)
+
+class requester(object):
+    """
+    REQ client with a timeout (lazy pirate): a request that gets no reply
+    within timeout seconds is sent again on a fresh socket, up to retries
+    times. request() returns the decoded reply, or None if the master did
+    not answer at all.
+    """
+    def __init__(self, context, address, timeout=5., retries=2):
+        self.context = context
+        self.address = address
+        self.timeout = timeout
+        self.retries = retries
+        self.socket = None
+        self._connect()
+
+    def _connect(self):
+        if self.socket is not None:
+            self.socket.setsockopt(zmq.LINGER, 0)
+            self.socket.close()
+        self.socket = self.context.socket(zmq.REQ)
+        self.socket.connect(self.address)
+
+    def request(self, message):
+        for attempt in range(self.retries+1):
+            self.socket.send(message)
+            if self.socket.poll(int(self.timeout*1000), zmq.POLLIN):
+                return zmqcodec.recvdict(self.socket)
+            print('dataservice: no reply from %s within %g s, attempt %d'%(self.address, self.timeout, attempt+1))
+            #a REQ socket without its reply cannot send again
+            self._connect()
+        return None
+
+def topic(name):
+    #topic frame of a column; the terminator keeps ipm4__sum from matching ipm4__sum2
+    return name.encode('utf-8')+b'\0'
+
+class publisher(Thread):
+    """
+    publishes the rows appended to store on the PUB socket, at most maxrate
+    times a second and only when there are new rows. Every column goes out
+    on its own topic (see topic()) as a zmqcodec dict with the column, the
+    sequence numbers before ('since') and after ('seq') its rows, 'reset'
+    and 'runNumber'. The socket belongs to this thread once it runs.
+    """
+    def __init__(self, store, socket, maxrate=1.):
+        Thread.__init__(self)
+        self.daemon=True
+        self.store=store
+        self.socket=socket
+        self.maxrate=maxrate
+
+    def run(self):
+        seq=None
+        while True:
+            t0=time.time()
+            if seq is None:
+                data=self.store.todict()
+                data['reset']=True
+            else:
+                data=self.store.delta(seq[0], seq[1])
+            since,seq=seq,data.pop('seq')
+            reset=data.pop('reset')
+            runNumber=data.pop('runNumber')
+            if reset or seq!=since:
+                for name,value in data.items():
+                    message={name: value, 'seq': seq, 'since': since, 'reset': reset, 'runNumber': runNumber}
+                    zmqcodec.senddict(self.socket, message, topic=topic(name))
+            time.sleep(max(0., 1./self.maxrate-(time.time()-t0)))
+
+class topictail(object):
+    """
+    subscriber side of publisher: the last n rows of the columns in names,
+    and of all columns starting with one of prefixes. update() returns the
+    columns that are at the newest sequence number, cut to the same length.
+    """
+    def __init__(self, n, names, prefixes=()):
+        self.n = n
+        self.names = list(names)
+        self.prefixes = list(prefixes)
+        self.seqs = {}
+        self.data = {}
+        self.runNumber = -1
+
+    def subscribe(self, socket):
+        for name in self.names:
+            socket.setsockopt(zmq.SUBSCRIBE, topic(name))
+        for prefix in self.prefixes:
+            socket.setsockopt(zmq.SUBSCRIBE, prefix.encode('utf-8'))
+
+    def add(self, message):
+        seq=tuple(message.pop('seq'))
+        since=message.pop('since')
+        reset=message.pop('reset')
+        self.runNumber=message.pop('runNumber')
+        for name,value in message.items():
+            local=self.data.get(name)
+            #rows continue ours only if we have everything up to since
+            if reset or name in BATCHMETA or local is None or since is None or self.seqs.get(name)!=tuple(since):
+                self.data[name]=value[-self.n:]
+            else:
+                self.data[name]=np.concatenate([local, value])[-self.n:]
+            self.seqs[name]=seq
+
+    def update(self, socket, timeout=5., quiet=0.1):
+        """
+        wait up to timeout seconds for published rows and merge everything that
+        came in, until every column in names has come at least once and then
+        nothing more came for quiet seconds. Returns the columns in the layout
+        of the old master dict, None if nothing has been published yet.
+        """
+        deadline=time.time()+timeout
+        wait=timeout
+        while socket.poll(int(wait*1000)):
+            name,message=zmqcodec.recvdict(socket, topic=True)
+            self.add(message)
+            wait=deadline-time.time()
+            if wait<=0:
+                break
+            #the other columns of the same update follow within quiet seconds
+            if all(name in self.seqs for name in self.names):
+                wait=min(wait, quiet)
+        if len(self.seqs)==0:
+            return None
+        seq=max(self.seqs.values())
+        names=[name for name in self.seqs if self.seqs[name]==seq]
+        nrows=min([len(self.data[name]) for name in names if name not in BATCHMETA] or [0])
+        data=dict((name, self.data[name] if name in BATCHMETA else self.data[name][-nrows:]) for name in names)
+        data['runNumber']=self.runNumber
+        return data
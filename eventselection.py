@@ -0,0 +1,106 @@
+import yaml
+
+#
+# event selection of the workers, declared in the event_selection section of
+# smalldata_plot.yml as a list of rules, each one of
+#   - require: ipm2                     the detector has to be in the event
+#   - damage: evr0                      the detector must not be damaged;
+#     required: true                    without required, events without a
+#                                       damage entry for it pass
+#   - var: ipm2__sum                    threshold on a scalar variable
+#     min: 0.1                          (min < value < max, either optional;
+#     max: 10.                          events without it pass unless required)
+# An event is selected if it passes all rules. Rules are checked from the
+# cheapest kind to the most expensive and each counts the events it rejected.
+# Without the section, DEFAULTRULES are used.
+#
+DEFAULTRULES=[{'damage': 'ipm2'},
+              {'damage': 'ipm5'},
+              {'damage': 'evr0', 'required': True},
+              {'damage': 'tt'},
+              {'damage': 'enc'}]
+#order of the rule kinds, cheapest first
+COSTS={'require': 0, 'damage': 1, 'var': 2}
+
+def _value(data, name):
+    #value of '<detector>__<variable>' (or of a plain entry) in the event data, None if there is none
+    if name in data:
+        return data[name]
+    det,sep,var=name.partition('__')
+    values=data.get(det)
+    if sep and isinstance(values, dict):
+        return values.get(var)
+    return None
+
+def _require(rule):
+    det=rule['require']
+    return lambda data: det in data
+
+def _damage(rule):
+    det=rule['damage']
+    required=rule.get('required', False)
+    def check(data):
+        damage=data.get('damage')
+        if damage is None or det not in damage:
+            return not required
+        return damage[det]>=1
+    return check
+
+def _var(rule):
+    name=rule['var']
+    vmin=rule.get('min')
+    vmax=rule.get('max')
+    required=rule.get('required', False)
+    def check(data):
+        value=_value(data, name)
+        if value is None:
+            return not required
+        return (vmin is None or value>vmin) and (vmax is None or value<vmax)
+    return check
+
+_MAKERS={'require': _require, 'damage': _damage, 'var': _var}
+
+def _kind(rule):
+    for kind in COSTS:
+        if kind in rule:
+            return kind
+    raise ValueError('event selection: do not know the rule %s'%(rule,))
+
+class eventselection(object):
+    """
+    the rules compiled into one predicate: selection(data) is True if the
+    event data (as from detData) passes all of them. rejected[i] counts the
+    events the i-th rule (in checking order, see names) rejected.
+    """
+    def __init__(self, rules):
+        rules=sorted(rules, key=lambda rule: COSTS[_kind(rule)])
+        self.names = ['%s %s'%(_kind(rule), rule[_kind(rule)]) for rule in rules]
+        self.checks = [_MAKERS[_kind(rule)](rule) for rule in rules]
+        self.rejected = [0]*len(rules)
+        self.nevents = 0
+
+    def __call__(self, data):
+        self.nevents+=1
+        for i,check in enumerate(self.checks):
+            if not check(data):
+                self.rejected[i]+=1
+                return False
+        return True
+
+    def summary(self):
+        rejected=', '.join('%s: %d'%(name, n) for name,n in zip(self.names, self.rejected) if n>0)
+        return 'selected %d of %d events%s'%(self.nevents-sum(self.rejected), self.nevents, ', rejected by '+rejected if rejected else '')
+
+def fromfile(filename='smalldata_plot.yml', extra=()):
+    """
+    selection with the rules of the event_selection section of filename (or
+    DEFAULTRULES) and the rules in extra.
+    """
+    try:
+        setupDict=yaml.load(open(filename,'r'))
+        rules=setupDict.get('event_selection')
+    except IOError:
+        rules=None
+    if rules is None:
+        rules=DEFAULTRULES
+    return eventselection(list(rules)+list(extra))
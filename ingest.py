@@ -0,0 +1,71 @@
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import time
+from threading import Thread
+from mpi4py import MPI
+
+#
+# master side threads: the MPI receive loop only pulls batches off the wire
+# into a bounded queue, the master loop applies them to the store and the run
+# number lookup runs on its own timer, so neither a slow web lookup nor a
+# big client request holds up the ranks sending to rank 0.
+# The receive thread calls MPI while the master thread sends acks and credits
+# back (mpidata.release), which needs MPI_THREAD_MULTIPLE; with a lower thread
+# level the master thread receives the batches itself.
+#
+
+def receivebatches(md, batches):
+    #blocks when the queue is full: a stuck aggregation pushes back on MPI
+    #instead of growing the queue without bound.
+    while True:
+        batches.put(md.recvbatch())
+
+class directreceiver(object):
+    """
+    stands in for the queue of startreceiver without a receive thread: get()
+    receives the next batch on the calling thread.
+    """
+    def __init__(self, md):
+        self.md=md
+
+    def get(self):
+        return self.md.recvbatch()
+
+def startreceiver(md, maxsize=64):
+    """
+    start the MPI receive thread for mpidata md; returns the queue of
+    mpibatch objects it fills, or a directreceiver if MPI does not allow
+    calls from several threads.
+    """
+    level=MPI.Query_thread()
+    if level<MPI.THREAD_MULTIPLE:
+        print('ingest: MPI thread level is %d, not THREAD_MULTIPLE (%d): receiving batches on the master thread'%(level, MPI.THREAD_MULTIPLE))
+        return directreceiver(md)
+    batches=queue.Queue(maxsize=maxsize)
+    thr=Thread(target=receivebatches, args=(md, batches))
+    thr.daemon=True
+    thr.start()
+    return batches
+
+class runwatcher(Thread):
+    """
+    looks up the current run number of the hutch every interval seconds.
+    runNumber stays -1 until the first lookup worked.
+    """
+    def __init__(self, hutch, interval=5.):
+        Thread.__init__(self)
+        self.daemon=True
+        self.hutch=hutch
+        self.interval=interval
+        self.runNumber=-1
+
+    def run(self):
+        import RegDB.experiment_info
+        while True:
+            try:
+                self.runNumber=RegDB.experiment_info.experiment_runs(self.hutch)[-1]['num']
+            except Exception as e:
+                print('runwatcher: failed to get run number for %s: %s'%(self.hutch, e))
+            time.sleep(self.interval)
@@ -6,6 +6,7 @@ size = comm.Get_size()
 import numpy as np
 from mpidata import mpidata 
 import zmq
+import zmqcodec
 import random
 import sys
 import time
@@ -25,9 +26,10 @@ def runmaster(nClients):
     socket.bind("tcp://*:%s" % port)
 
     myDict={}
+    #one receiver for the whole run: it keeps the registered batch layouts.
+    md = mpidata()
     while nClients > 0:
         # Remove client if the run ended
-        md = mpidata()
         md.recv()
         ##ideally, there is a reset option from the bokeh server, but we can make this 
         ##optional & reset on run boundaries instead/in addition.
@@ -43,16 +45,17 @@ def runmaster(nClients):
             #append the lists in the dictionary we got from the clients to a big master dict.
             for mds in md.small.arrayinfolist:
                 if mds.name not in myDict.keys():
-                    myDict[mds.name]=getattr(md, mds.name)
+                    myDict[mds.name]=getattr(md, mds.name).copy()
                 else:
                     myDict[mds.name]=np.append(myDict[mds.name], getattr(md, mds.name), axis=0)
 
             #md.addarray('evt_ts',np.array(evt_ts))
             evt_ts_str = '%.4f'%(md.send_timeStamp[0] + md.send_timeStamp[1]/1e9)
+            md.release()
             #here we will send the dict (or whatever we make this here) to the plots.
 
             #I don't think this will work: this loop needs to be active....
             while True:
                 message = socket.recv()
                 print("smallData master received request: ", message)
-                socket.send_pyobj(myDict)
+                zmqcodec.senddict(socket, myDict)
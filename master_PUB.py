@@ -5,7 +5,10 @@ size = comm.Get_size()
 
 import numpy as np
 from mpidata import mpidata 
+from columnstore import columnstore
+from ingest import startreceiver, runwatcher
 import zmq
+import dataservice
 import random
 import sys
 import time
@@ -31,7 +34,13 @@ def runmaster(nClients):
     socket = context.socket(zmq.PUB)
     socket.bind("tcp://*:%s" % master_port)
 
-    myDict={'runNumber':-1}
+    #keep the last number_of_events events of each variable in preallocated ring buffers
+    #with store_dir, in memory mapped files that a restarted master picks up again
+    store=columnstore(setupDict['master'].get('number_of_events', 14400), path=setupDict['master'].get('store_dir'))
+
+    #new rows go out on their own timer, one topic per variable, not once per batch.
+    pub = dataservice.publisher(store, socket, setupDict['master'].get('publish_rate', 1.))
+    pub.start()
 
     hutches=['amo','sxr','xpp','xcs','mfx','cxi','mec']
     hutch=None
@@ -53,61 +62,46 @@ def runmaster(nClients):
     if hutch is None:
         print('cannot figure out which hutch we are in to use. resetting at end of run will not work')
 
-    #main "thread" to get the MPI data and append it to the dict.
+    #MPI receive thread: only pulls batches into a bounded queue.
+    #one receiver for the whole run: it keeps the registered batch layouts.
+    #each worker may have `credits` batches in flight, a credit goes back when
+    #a batch has been applied to the store.
+    md = mpidata(grant=setupDict['master'].get('credits', 4))
+    batches = startreceiver(md, setupDict['master'].get('queue_depth', 64))
+
+    ##here, I'm resetting the master dict on a new run. For now, this is not exactly how this should run.
+    ##need to maybe use a deque for the jet tracking? Figure out much later how to combine...
+    #watcher = runwatcher(hutch, setupDict['master'].get('run_check_interval', 5.))
+    #watcher.start()
+
+    #main "thread" to get the batches from the queue and append them to the store.
     nDataReceived=0
+    lastDropped=(0, 0)
     print('About to start the while loop for the master process w/ %d clients'%nClients)
     while nClients > 0:
+        batch = batches.get()
         print('MASTER got data: ',nDataReceived)
         nDataReceived+=1
-        ##get current run number & reset if new. Put into thread?
-        ##here, I'm resetting the master dict on a new run. For now, this is not exactly how this should run.
-        ##need to maybe use a deque for the jet tracking? Figure out much later how to combine...
-        #if hutch is not None and nDataReceived%(size-1)==(size-2):
-        #    lastRun = RegDB.experiment_info.experiment_runs(hutch)[-1]['num'] 
-        #    #if the run number has changed, reset the master dictionary & set the new run number.
-        #    if lastRun != myDict['runNumber']:
-        #        print('Reset master dict, new run number: %d'%lastRun)
-        #        myDict.clear()
-        #        myDict['runNumber']=lastRun
+        #if watcher.runNumber>=0 and watcher.runNumber != store.runNumber:
+        #    print('Reset master dict, new run number: %d'%watcher.runNumber)
+        #    store.clear(runNumber=watcher.runNumber)
 
-        # Remove client if the run ended
-        md = mpidata()
-        md.recv()
         ##ideally, there is a reset option from the bokeh server, but we can make this 
         ##optional & reset on run boundaries instead/in addition.
-        if md.small.endrun: #what if going from just running to recording?
+        if batch.endrun: #what if going from just running to recording?
             print('ENDRUN!')
             #nClients -= 1 #No...
-            myDict.clear()
-            myDict['runNumber']=lastRun
+            store.clear()
         else:
-            print('DEBUG: master: ', md.nEvts)   
-            #append the lists in the dictionary we got from the clients to a big master dict.
-            for mds in md.small.arrayinfolist:
-                #print 'mds name: ',mds.name
-                if mds.name not in myDict.keys():
-                    myDict[mds.name]=getattr(md, mds.name)
-                else:
-                    myDict[mds.name]=np.append(myDict[mds.name], getattr(md, mds.name), axis=0)
-            #check if dict is aligned
-            for mds in md.small.arrayinfolist:
-                if mds.name=='nEvts': continue
-                if mds.name=='send_timeStamp': continue
-                if myDict[mds.name].shape[0]!=myDict['event_time'].shape[0]:
-                    print('We are out of alignment for %s '%mds.name, myDict[mds.name].shape[0],  myDict['event_time'].shape[0])
-
-            #md.addarray('evt_ts',np.array(evt_ts))
-            evt_ts_str = '%.4f'%(md.send_timeStamp[0] + md.send_timeStamp[1]/1e9)
-            #here we will send the dict (or whatever we make this here) to the plots.
-            print('master data: ', myDict.keys())
-            print('master has events: ', myDict['lightStatus__xray'].shape)
+            print('DEBUG: master: ', dict(batch.columns)['nEvts'])
+            #append the arrays we got from the clients to the master store.
+            #columns that do not line up with event_time are reported and skipped.
+            store.append(batch.columns)
+            if md.droppedtotals()!=lastDropped:
+                lastDropped=md.droppedtotals()
+                print('master: falling behind, senders dropped %d batches and %d events so far'%lastDropped)
+            print('master data: ', store.keys())
+            print('master has events: ', len(store))
 
-            #
-            # this is if we send data off via ZMQ.
-            #
-            #print("smallData master received request: ", message)
-            #if len(dict_to_send.keys())>0:
-            #    print("smallData master will send : ", dict_to_send['lightStatus__xray'].shape)
-            #else:
-            #    print("we have an empty dictionary right now....")
-            socket.send_pyobj(myDict)
+        #the store has copied the batch, recycle its receive buffer
+        md.release(batch)
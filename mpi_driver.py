@@ -5,24 +5,58 @@
 #from master_PUB import runmaster
 from master import runmaster
 from worker import runworker
+from aggregator import maketopology, runaggregator
+import shmtransport
+import batchcodec
+import replay
 
 from mpi4py import MPI
 comm = MPI.COMM_WORLD
 rank = comm.Get_rank()
 size = comm.Get_size()
 assert size>1, 'At least 2 MPI ranks required'
-numClients = size-1
 
 import argparse
 parser = argparse.ArgumentParser()
 parser.add_argument("exprun", help="psana experiment/run string (e.g. exp=xppd7114:run=43)")
 parser.add_argument("-n","--noe",help="number of events, all events=0",default=-1, type=int)
+parser.add_argument("--aggregate",help="merge worker batches before the master: 'node' for one aggregator rank per host, K for one per K workers",default=None)
+parser.add_argument("--aggregate_rows",help="events an aggregator collects before forwarding",default=1000, type=int)
+parser.add_argument("--aggregate_delay",help="max. seconds an aggregator holds events",default=1., type=float)
+parser.add_argument("--shm_slotsize",help="MB per shared memory batch slot between ranks on the same host, 0 to always use MPI",default=4, type=int)
+parser.add_argument("--shm_slots",help="shared memory batch slots per rank",default=4, type=int)
+parser.add_argument("--compress",help="compress batches sent to other hosts: off, auto, lz4 or zlib",default='off')
+parser.add_argument("--compress_min",help="batches below this many bytes are sent uncompressed",default=16384, type=int)
+parser.add_argument("--overload",help="when the master runs out of credits for a rank: block, drop (oldest batch) or coarsen (merge and thin out batches); off for no flow control",default='block')
+parser.add_argument("--batch_size",help="events a worker collects before sending",default=50, type=int)
+parser.add_argument("--batch_age",help="max. seconds a worker holds events before sending",default=1., type=float)
+parser.add_argument("--batch_adaptive",help="size worker batches from the event rate (to fill in --batch_latency seconds), keeping to --master_batchrate",action='store_true')
+parser.add_argument("--batch_latency",help="seconds an adaptive batch should take to fill",default=0.5, type=float)
+parser.add_argument("--master_batchrate",help="batches per second all workers together may send with --batch_adaptive",default=200., type=float)
+parser.add_argument("--replay",help="rate of all workers together when playing xtc files: events per second, max for as fast as possible, real for the spacing of the event timestamps",default='120')
+parser.add_argument("--replay_speed",help="speed-up of --replay real",default=1., type=float)
+parser.add_argument("--credits",help="batches each child of an aggregator may have in flight",default=4, type=int)
 
 args = parser.parse_args()
 
-if rank==0:
-    runmaster(numClients)
+aggregate = args.aggregate
+if aggregate is not None and aggregate!='node':
+    aggregate = int(aggregate)
+topo = maketopology(aggregate)
+#batches to a parent on the same host go through shared memory
+shmtransport.setup(topo.parents, args.shm_slotsize<<20, args.shm_slots)
+if args.compress!='off':
+    batchcodec.setup(args.compress, minbatch=args.compress_min)
+
+policy = args.overload if args.overload!='off' else None
+#the workers agree on the start of the replay schedule once they are set up
+workercomm = comm.Split(1 if topo.role=='worker' else MPI.UNDEFINED, rank)
+
+if topo.role=='master':
+    runmaster(len(topo.children))
+elif topo.role=='aggregator':
+    runaggregator(topo, args.aggregate_rows, args.aggregate_delay, args.credits, policy)
 else:
-    runworker(args)
+    runworker(args, topo, policy, replay.fromargs(args, workercomm))
 
 MPI.Finalize()
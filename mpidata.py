@@ -1,9 +1,213 @@
+import struct
+import time
 import numpy as np
+import shmtransport
+import batchcodec
+from columnstore import DROPMETA, batchkey, batchevents, mergebatches, thinbatch
 from mpi4py import MPI
 comm = MPI.COMM_WORLD
 rank = comm.Get_rank()
 size = comm.Get_size()
 
+#
+# wire format: one message per batch. All columns are packed into a single
+# contiguous byte buffer behind a small binary header:
+#   batch header:  magic, flags, number of columns (or schema id), header length
+#   column header: name length, dtype length, ndim, data offset, data length,
+#                  followed by name, dtype string and shape (int64 each)
+# column data starts on ALIGN byte boundaries so the receiver can make
+# zero-copy numpy views into the receive buffer.
+#
+# The column headers only need to travel once per layout: batches are
+# self-describing until a layout repeats, then one is flagged FLAG_SCHEMA,
+# the receiver registers it and replies with a schema id. Later batches with
+# that layout are just the batch header (FLAG_SCHEMAID, id) and the payload.
+#
+# Between ranks on the same host the batch is packed into a shared memory
+# slot instead (see shmtransport) and the MPI message is only a notice:
+# the batch header with FLAG_SHM, the slot and the batch size.
+#
+# Batches to other hosts can be compressed (see batchcodec); their payload is
+# then the encoded columns, flagged FLAG_CODEC.
+#
+# Flow control: a sender with an overload policy flags its batches
+# FLAG_CREDIT and may only have a limited number of them in flight. The
+# receiver hands a credit back once a batch is consumed (on the first batch of
+# a sender: its whole grant). The credit message also returns the shared
+# memory slot of the batch: int64 [slot or -1, credits].
+#
+BATCHTAG = 1
+SCHEMATAG = 2
+CREDITTAG = 3
+ALIGN = 64
+MAGIC = 0x31444d53 #'SMD1'
+FLAG_ENDRUN = 1
+FLAG_SCHEMA = 2
+FLAG_SCHEMAID = 4
+FLAG_SHM = 8
+FLAG_CODEC = 16
+FLAG_CREDIT = 32
+POLICIES = ('block', 'drop', 'coarsen')
+#layouts a sender remembers before it starts over
+MAXLAYOUTS = 256
+_batchhead = struct.Struct('<IIII')
+_colhead = struct.Struct('<HBBQQ')
+
+def _aligned(nbytes):
+    return (nbytes+ALIGN-1)//ALIGN*ALIGN
+
+def _growbuffer(buf, nbytes):
+    #reuse the buffer if it is large enough, otherwise allocate with headroom
+    if buf is not None and buf.nbytes>=nbytes:
+        return buf
+    if buf is not None:
+        nbytes=max(nbytes, 2*buf.nbytes)
+    return np.empty(_aligned(nbytes), dtype=np.uint8)
+
+def _putbytes(buf, pos, data):
+    buf[pos:pos+len(data)]=np.frombuffer(data, dtype=np.uint8)
+
+class batchlayout(object):
+    """
+    names, dtypes and shapes of the columns in a batch and where each column
+    sits in the payload. key is hashable and identifies the layout.
+    """
+    def __init__(self, key):
+        self.key = key
+        self.names = [name for name,dtype,shape in key]
+        self.dtypes = [np.dtype(dtype) for name,dtype,shape in key]
+        self.shapes = [shape for name,dtype,shape in key]
+        colheads=[]
+        self.offsets=[]
+        self.sizes=[]
+        offset=0
+        for name,dtype,shape in key:
+            nbytes=np.dtype(dtype).itemsize*int(np.prod(shape))
+            bname=name.encode('utf-8')
+            bdtype=dtype.encode('ascii')
+            colheads.append(_colhead.pack(len(bname), len(bdtype), len(shape), offset, nbytes)
+                            +bname+bdtype+struct.pack('<%dq'%len(shape), *shape))
+            self.offsets.append(offset)
+            self.sizes.append(nbytes)
+            offset=_aligned(offset+nbytes)
+        self.colheads=b''.join(colheads)
+        self.headlen=_batchhead.size+len(self.colheads)
+        self.nbytes=offset
+        self.nsent=0
+
+    @classmethod
+    def fromarrays(cls, names, arrays):
+        return cls(tuple((name, arr.dtype.str, arr.shape) for name,arr in zip(names, arrays)))
+
+    @classmethod
+    def fromheader(cls, buf, ncols):
+        key=[]
+        pos=_batchhead.size
+        for icol in range(ncols):
+            lname,ldtype,ndim,off,nbytes=_colhead.unpack_from(buf, pos)
+            pos+=_colhead.size
+            name=buf[pos:pos+lname].tobytes().decode('utf-8')
+            pos+=lname
+            dtype=buf[pos:pos+ldtype].tobytes().decode('ascii')
+            pos+=ldtype
+            shape=struct.unpack_from('<%dq'%ndim, buf, pos)
+            pos+=8*ndim
+            key.append((name, dtype, shape))
+        return cls(tuple(key))
+
+    def describing(self):
+        #size and payload start of the self-describing message
+        payload=_aligned(self.headlen)
+        return payload+self.nbytes, payload
+
+    def packheader(self, buf, flags=0):
+        _batchhead.pack_into(buf, 0, MAGIC, flags, len(self.names), self.headlen)
+        _putbytes(buf, _batchhead.size, self.colheads)
+
+    def packdata(self, buf, payload, arrays):
+        for arr,off,nbytes in zip(arrays, self.offsets, self.sizes):
+            if nbytes>0:
+                buf[payload+off:payload+off+nbytes]=np.ascontiguousarray(arr).view(np.uint8).reshape(-1)
+
+    def views(self, buf, payload):
+        columns=[]
+        for name,dtype,shape,off,nbytes in zip(self.names, self.dtypes, self.shapes, self.offsets, self.sizes):
+            arr=np.frombuffer(buf, dtype=dtype, count=nbytes//dtype.itemsize, offset=payload+off).reshape(shape)
+            columns.append((name, arr))
+        return columns
+
+def packbatch(names, arrays, flags=0, buf=None):
+    """
+    pack the arrays into one self-describing contiguous buffer.
+    Returns (buffer, nbytes); the buffer is reused if passed in and large enough.
+    """
+    layout=batchlayout.fromarrays(names, arrays)
+    nbytes,payload=layout.describing()
+    buf=_growbuffer(buf, nbytes)
+    layout.packheader(buf, flags)
+    layout.packdata(buf, payload, arrays)
+    return buf, nbytes
+
+def unpackheader(buf, schemas=None):
+    """
+    parse the header of a packed batch. Returns (flags, layout, payload
+    start). Batches sent by schema id need the dict of registered layouts.
+    """
+    magic,flags,ncols,headlen=_batchhead.unpack_from(buf, 0)
+    assert magic==MAGIC, 'not a smalldata batch'
+    if flags & FLAG_SCHEMAID:
+        return flags, schemas[ncols], headlen
+    return flags, batchlayout.fromheader(buf, ncols), _aligned(headlen)
+
+def unpackbatch(buf, schemas=None):
+    """
+    parse a packed, not encoded batch. Returns (flags, layout, [(name, array)])
+    where the arrays are views into buf.
+    """
+    flags,layout,payload=unpackheader(buf, schemas)
+    return flags, layout, layout.views(buf, payload)
+
+class bufferpool(object):
+    """
+    recycled receive buffers, grouped in power of two size classes so that
+    steady-state ingest does not allocate. get() hands out a buffer of at
+    least nbytes, put() gives it back once its contents have been consumed.
+    """
+    def __init__(self, maxfree=4):
+        self.maxfree = maxfree
+        self.free = {}
+        self.nallocated = 0
+
+    def _sizeclass(self, nbytes):
+        return 1<<max(12, (int(nbytes)-1).bit_length())
+
+    def get(self, nbytes):
+        sizeclass=self._sizeclass(nbytes)
+        buffers=self.free.get(sizeclass)
+        if buffers:
+            return buffers.pop()
+        self.nallocated+=1
+        return np.empty(sizeclass, dtype=np.uint8)
+
+    def put(self, buf):
+        buffers=self.free.setdefault(buf.nbytes, [])
+        if len(buffers)<self.maxfree:
+            buffers.append(buf)
+
+class mpibatch(object):
+    """
+    one received batch: the sending rank, its columns as views into buf
+    and the endrun flag. Hand it back with mpidata.release(batch).
+    """
+    def __init__(self, rank, flags, columns, buf, shmslot=None):
+        self.rank = rank
+        self.flags = flags
+        self.endrun = bool(flags & FLAG_ENDRUN)
+        self.columns = columns
+        self.buf = buf
+        #shared memory slot of the sender the batch was read from
+        self.shmslot = shmslot
+
 class arrayinfo(object):
     def __init__(self,name,array):
         self.name = name
@@ -18,34 +222,391 @@ class small(object):
         self.arrayinfolist.append(arrayinfo(name,array))
 
 class mpidata(object):
+    """
+    sends batches to dest, or receives them from any rank.
+    policy: flow control for sending, None to send whenever asked. With
+    'block' a batch waits for a credit from dest, 'drop' queues up to
+    maxpending batches and drops the oldest, 'coarsen' merges the two oldest
+    queued batches and keeps every second event instead.
+    grant: batches a sender may have in flight to this receiver.
+    """
+    def __init__(self, nbuffers=2, dest=0, shm=None, codec=None, policy=None, maxpending=4, grant=4):
+        #dest: rank the batches go to, the master or an aggregator
+        self.dest = dest
+        if policy is not None and policy not in POLICIES:
+            raise ValueError('unknown overload policy %s'%policy)
+        self.policy = policy
+        self.maxpending = maxpending
+        #one batch may always go out, the receiver's grant comes back with its credit
+        self.credits = 1
+        #batches dest still has to hand back (credit or shared memory slot)
+        self.unacked = 0
+        self.creditbuf = np.empty(2, dtype=np.int64)
+        #batches waiting for a credit (drop and coarsen)
+        self.pending = []
+        self.nBatches_dropped = 0
+        self.nEvts_dropped = 0
+        #mpidata we receive from, if we forward its batches: its drops are reported as ours
+        self.upstream = None
+        #receiver side: credits per sender and what the senders reported dropped
+        self.grant = grant
+        self.granted = set()
+        self.dropped = {}
+        #shared memory transport, used for dest on the same host
+        self.shm = shm if shm is not None else shmtransport.active
+        #compression, only used for dest on another host
+        self.codec = codec if codec is not None else batchcodec.default
+        if self.shm is not None and self.shm.samehost(dest):
+            self.codec = None
+        self.notice = np.empty(_batchhead.size, dtype=np.uint8)
+        self.small=small()
+        self.arraylist = []
+        self.sendbuf = None
+        self.lastbatch = None
+        self.recvRank = None
+        self.pool = bufferpool()
+        #buffers for the non-blocking sends, used in turn.
+        self.sendbufs = [None]*nbuffers
+        self.sendreqs = [MPI.REQUEST_NULL]*nbuffers
+        #persistent send per buffer: (schema id, buffer, request) for the layout and buffer it was set up for
+        self.persistent = [None]*nbuffers
+        self.stalltime = 0.
+        self.nstalls = 0
+        #worker side: known layouts and the schema ids the master gave them
+        self.layouts = {}
+        self.schemaids = {}
+        self.pendingschema = None
+        #master side: registered layouts by schema id
+        self.schemas = {}
 
-    def __init__(self):
+    def _clear(self):
         self.small=small()
         self.arraylist = []
 
+    def _layout(self):
+        for arr in self.arraylist:
+            assert arr.flags['C_CONTIGUOUS']
+        key=tuple((arrinfo.name, arrinfo.dtype.str, arrinfo.shape) for arrinfo in self.small.arrayinfolist)
+        layout=self.layouts.get(key)
+        if layout is None:
+            if len(self.layouts)>=MAXLAYOUTS:
+                self.layouts={}
+            layout=batchlayout(key)
+            self.layouts[key]=layout
+        layout.nsent+=1
+        return layout
+
+    def _schemaid(self, layout):
+        """
+        schema id for this layout, or None if it is not registered yet. In
+        that case the batch goes out self-describing and the first such batch
+        asks the master to register it; the reply is picked up without blocking.
+        Returns (schema id, flags for a self-describing batch).
+        """
+        if self.pendingschema is not None:
+            key,req,idbuf=self.pendingschema
+            if req.Test():
+                self.schemaids[key]=int(idbuf[0])
+                self.pendingschema=None
+        schemaid=self.schemaids.get(layout.key)
+        if schemaid is not None:
+            return schemaid, 0
+        #one-off layouts (e.g. merged batches of varying size) are not registered
+        if self.pendingschema is not None or layout.nsent<2:
+            return None, 0
+        idbuf=np.empty(1, dtype=np.int64)
+        req=comm.Irecv(idbuf, source=self.dest, tag=SCHEMATAG)
+        self.pendingschema=(layout.key, req, idbuf)
+        return None, FLAG_SCHEMA
+
+    def _pack(self, buf, layout, codec=None):
+        """
+        pack the current arrays into buf, compressed if a codec is given and
+        the batch is worth it. Returns (buffer, nbytes, schema id, encoded).
+        """
+        schemaid,flags=self._schemaid(layout)
+        if self.policy is not None:
+            flags|=FLAG_CREDIT
+        encoded=codec.encode(layout, self.arraylist) if codec is not None else None
+        if encoded is not None:
+            flags|=FLAG_CODEC
+        if schemaid is None:
+            payload=layout.describing()[1]
+        else:
+            payload=ALIGN
+        if encoded is None:
+            nbytes=payload+layout.nbytes
+        else:
+            nbytes=payload+batchcodec.packedsize(encoded)
+        buf=_growbuffer(buf, nbytes)
+        if schemaid is None:
+            layout.packheader(buf, flags)
+        else:
+            _batchhead.pack_into(buf, 0, MAGIC, FLAG_SCHEMAID|flags, schemaid, ALIGN)
+        if encoded is None:
+            layout.packdata(buf, payload, self.arraylist)
+        else:
+            batchcodec.pack(buf, payload, encoded)
+        return buf, nbytes, schemaid, encoded is not None
+
+    def _shmsend(self, layout):
+        """
+        pack the batch straight into a shared memory slot and send the notice.
+        Returns False if there is no shared memory to dest, the batch does not
+        fit or all slots are still being read: then it goes through MPI.
+        """
+        if self.shm is None or not self.shm.enabled(self.dest) or layout.describing()[0]>self.shm.slotsize:
+            return False
+        self._credits()
+        slot=self.shm.getslot()
+        if slot is None:
+            return False
+        buf,nbytes,schemaid,encoded = self._pack(self.shm.slotbuffer(slot), layout)
+        self.shm.publish()
+        _batchhead.pack_into(self.notice, 0, MAGIC, FLAG_SHM, slot, nbytes)
+        comm.Send([self.notice, _batchhead.size, MPI.BYTE],dest=self.dest,tag=BATCHTAG)
+        self.unacked+=1
+        return True
+
+    def _freebuffer(self):
+        #index of a send buffer that is not in flight. Only block when all are.
+        for ibuf,req in enumerate(self.sendreqs):
+            if req.Test():
+                return ibuf, 0.
+        t0=time.time()
+        ibuf=MPI.Request.Waitany(self.sendreqs)
+        return ibuf, time.time()-t0
+
+    def _credits(self, block=False):
+        #pick up credits and shared memory slots dest handed back; block waits for one
+        while block or comm.Iprobe(source=self.dest, tag=CREDITTAG):
+            comm.Recv(self.creditbuf, source=self.dest, tag=CREDITTAG)
+            slot,credits=self.creditbuf
+            if slot>=0:
+                self.shm.freeslot(int(slot))
+            self.credits+=int(credits)
+            self.unacked-=1
+            block=False
+
+    def _report(self):
+        #cumulative drops of this sender and of the ranks it forwards for
+        if self.policy is None and self.upstream is None:
+            return
+        nbatches,nevents=self.nBatches_dropped,self.nEvts_dropped
+        if self.upstream is not None:
+            upbatches,upevents=self.upstream.droppedtotals()
+            nbatches+=upbatches
+            nevents+=upevents
+        self.addarray('nBatches_dropped', np.array([nbatches]))
+        self.addarray('nEvts_dropped', np.array([nevents]))
+
+    def _setcolumns(self, columns):
+        self._clear()
+        for name,arr in columns:
+            self.addarray(name,arr)
+
+    def _enqueue(self):
+        #keep a copy of the current batch until there is a credit for it
+        columns=[(arrinfo.name, np.array(arr)) for arrinfo,arr in zip(self.small.arrayinfolist, self.arraylist)]
+        self._clear()
+        self.pending.append(columns)
+        if len(self.pending)<=self.maxpending:
+            return
+        if self.policy=='coarsen' and batchkey(self.pending[0])==batchkey(self.pending[1]):
+            merged,nevents=thinbatch(mergebatches(self.pending[:2]))
+            self.pending[:2]=[merged]
+        else:
+            nevents=batchevents(self.pending.pop(0))
+            self.nBatches_dropped+=1
+        self.nEvts_dropped+=nevents
+
+    def _flow(self, transmit):
+        """
+        send the current batch with transmit under the overload policy.
+        Returns the time spent waiting for a credit or a send buffer.
+        """
+        if self.policy is None:
+            self._report()
+            return transmit()
+        self._credits()
+        stall=0.
+        if self.policy=='block' or (self.credits>0 and len(self.pending)==0):
+            if self.credits==0:
+                t0=time.time()
+                self._credits(block=True)
+                stall=time.time()-t0
+                self.stalltime+=stall
+                self.nstalls+=1
+            self.credits-=1
+            self._report()
+            return stall+transmit()
+        self._enqueue()
+        while self.credits>0 and len(self.pending)>0:
+            self._setcolumns(self.pending.pop(0))
+            self.credits-=1
+            self._report()
+            stall+=transmit()
+        return stall
+
+    def droppedtotals(self):
+        #(batches, events) the senders to this receiver reported dropped
+        dropped=list(self.dropped.values())
+        return sum(nb for nb,ne in dropped), sum(ne for nb,ne in dropped)
+
+    def flush(self):
+        #wait for all outstanding non-blocking sends
+        MPI.Request.Waitall(self.sendreqs)
+
     def endrun(self):
+        #batches still waiting for credits go out first
+        while len(self.pending)>0:
+            self._credits(block=self.credits==0)
+            self._setcolumns(self.pending.pop(0))
+            self.credits-=1
+            self._report()
+            self._isend()
+        #do not leave while dest still has messages for us
+        while self.unacked>0:
+            self._credits(block=True)
+        self.flush()
+        for ibuf,persistent in enumerate(self.persistent):
+            if persistent is not None:
+                persistent[2].Free()
+                self.persistent[ibuf]=None
+        if self.pendingschema is not None:
+            self.pendingschema[1].Wait()
+            self.pendingschema=None
         self.small.endrun = True
-        comm.send(self.small,dest=0,tag=rank)
+        self.sendbuf,nbytes = packbatch([], [], flags=FLAG_ENDRUN, buf=self.sendbuf)
+        comm.Send([self.sendbuf, nbytes, MPI.BYTE],dest=self.dest,tag=BATCHTAG)
 
     def addarray(self,name,array):
         self.arraylist.append(array)
         self.small.addarray(name,array)
 
     def send(self):
-        assert rank!=0
-        comm.send(self.small,dest=0,tag=rank)
-        for arr in self.arraylist:
-            assert arr.flags['C_CONTIGUOUS']
-            comm.Send(arr,dest=0,tag=rank)
+        assert self.dest!=rank
+        self._flow(self._send)
 
-    def recv(self):
-        assert rank==0
-        status=MPI.Status()       
-        self.small=comm.recv(source=MPI.ANY_SOURCE,tag=MPI.ANY_TAG,status=status)
+    def _send(self):
+        layout=self._layout()
+        if not self._shmsend(layout):
+            self.sendbuf,nbytes,schemaid,encoded = self._pack(self.sendbuf, layout, self.codec)
+            comm.Send([self.sendbuf, nbytes, MPI.BYTE],dest=self.dest,tag=BATCHTAG)
+            if self.policy is not None:
+                self.unacked+=1
+        self._clear()
+        return 0.
+
+    def isend(self):
+        """
+        non-blocking send: pack the batch into a free send buffer and return
+        right away while it is in flight. Only waits when every buffer is still
+        outstanding or, with flow control, for a credit; returns the time spent
+        waiting (also summed in stalltime). Once the layout has a schema id the
+        buffer keeps a persistent request.
+        """
+        assert self.dest!=rank
+        return self._flow(self._isend)
+
+    def _isend(self):
+        layout=self._layout()
+        if self._shmsend(layout):
+            self._clear()
+            return 0.
+        ibuf,stall = self._freebuffer()
+        if stall>0:
+            self.stalltime+=stall
+            self.nstalls+=1
+        buf=self.sendbufs[ibuf]
+        self.sendbufs[ibuf],nbytes,schemaid,encoded = self._pack(buf, layout, self.codec)
+        #persistent requests need a fixed size: not for self-describing or compressed batches
+        if schemaid is None or encoded:
+            self.sendreqs[ibuf] = comm.Isend([self.sendbufs[ibuf], nbytes, MPI.BYTE],dest=self.dest,tag=BATCHTAG)
+        else:
+            #the request is bound to the buffer it was made for, which an
+            #earlier self-describing or compressed batch may have replaced
+            persistent=self.persistent[ibuf]
+            if persistent is None or persistent[0]!=schemaid or persistent[1] is not self.sendbufs[ibuf]:
+                if persistent is not None:
+                    persistent[2].Free()
+                req=comm.Send_init([self.sendbufs[ibuf], nbytes, MPI.BYTE],dest=self.dest,tag=BATCHTAG)
+                persistent=(schemaid, self.sendbufs[ibuf], req)
+                self.persistent[ibuf]=persistent
+            persistent[2].Start()
+            self.sendreqs[ibuf] = persistent[2]
+        if self.policy is not None:
+            self.unacked+=1
+        self._clear()
+        return stall
+
+    def release(self, batch=None):
+        #the arrays of a batch (default: the last one from recv) are consumed, recycle its buffer
+        if batch is None:
+            batch,self.lastbatch = self.lastbatch,None
+        if batch is None or batch.buf is None:
+            return
+        if batch.shmslot is None:
+            self.pool.put(batch.buf)
+        credits=0
+        if batch.flags & FLAG_CREDIT:
+            credits=1 if batch.rank in self.granted else self.grant
+            self.granted.add(batch.rank)
+        if batch.shmslot is not None or credits>0:
+            slot=batch.shmslot if batch.shmslot is not None else -1
+            comm.Send(np.array([slot, credits], dtype=np.int64), dest=batch.rank, tag=CREDITTAG)
+        batch.buf = None
+
+    def poll(self):
+        #is there a batch waiting to be received?
+        return comm.Iprobe(source=MPI.ANY_SOURCE,tag=BATCHTAG)
+
+    def recvbatch(self):
+        """
+        receive the next batch from any worker into a pooled buffer, or read
+        it from the sender's shared memory slot, and return it as an mpibatch.
+        Layout registrations are answered here before the batch is handed back.
+        """
+        status=MPI.Status()
+        #matched probe: the message we size the buffer for is the one we receive.
+        #only batches: an aggregator also gets schema replies from its own parent.
+        msg=comm.Mprobe(source=MPI.ANY_SOURCE,tag=BATCHTAG,status=status)
+        nbytes=status.Get_count(MPI.BYTE)
+        buf=self.pool.get(nbytes)
+        msg.Recv([buf, nbytes, MPI.BYTE])
         recvRank = status.Get_source()
-        if not self.small.endrun:
-            for arrinfo in self.small.arrayinfolist:
-                if not hasattr(self,arrinfo.name) or arr.shape!=arrinfo.shape or arr.dtype!=arrinfo.dtype:
-                    setattr(self,arrinfo.name,np.empty(arrinfo.shape,dtype=arrinfo.dtype))
-                arr = getattr(self,arrinfo.name)
-                comm.Recv(arr,source=recvRank,tag=MPI.ANY_TAG)
+        shmslot=None
+        magic,flags,slot,headlen=_batchhead.unpack_from(buf, 0)
+        if flags & FLAG_SHM:
+            self.pool.put(buf)
+            shmslot=slot
+            buf=self.shm.read(recvRank, slot)
+        flags,layout,payload=unpackheader(buf, self.schemas)
+        if flags & FLAG_CODEC:
+            decoded=self.pool.get(layout.nbytes)
+            batchcodec.decode(buf, payload, layout, decoded)
+            self.pool.put(buf)
+            buf,payload=decoded,0
+        columns=layout.views(buf, payload)
+        if DROPMETA[0] in layout.names:
+            reported=dict(columns)
+            self.dropped[recvRank]=tuple(int(reported[name][0]) for name in DROPMETA)
+        if flags & FLAG_SCHEMA:
+            schemaid=len(self.schemas)
+            self.schemas[schemaid]=layout
+            comm.Send(np.array([schemaid], dtype=np.int64), dest=recvRank, tag=SCHEMATAG)
+        return mpibatch(recvRank, flags, columns, buf, shmslot)
+
+    def recv(self):
+        """
+        receive the next batch and set its arrays as attributes. They are
+        views into a pooled buffer: call release() once they have been consumed.
+        """
+        batch=self.recvbatch()
+        self.lastbatch = batch
+        self.recvRank = batch.rank
+        self.small=small()
+        self.small.endrun = batch.endrun
+        for name,arr in batch.columns:
+            self.small.addarray(name,arr)
+            setattr(self,name,arr)
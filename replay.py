@@ -0,0 +1,81 @@
+import time
+from mpi4py import MPI
+
+#
+# pacing of offline replay (xtc files), to load-test the live pipeline at a
+# known rate. The workers share one token bucket without talking to each
+# other: event n of the run is due at t0+n/rate on every rank and each worker
+# waits for the events it handles. t0 is agreed on by the workers right
+# before their event loops (synchronize), once the slowest one has its data
+# source and detectors set up. The schedule is absolute, so the time spent
+# processing an event is not added on top and the rate does not drift.
+#
+
+def eventseconds(eventtime):
+    #EventId.time(): (seconds, nanoseconds)
+    return eventtime[0]+eventtime[1]*1e-9
+
+class replayclock(object):
+    """
+    rate: events per second of all workers together, None for as fast as
+    possible. realtime: space the events like their EventId timestamps
+    instead, sped up by speed. A rank more than burst seconds behind its
+    schedule gives up the time it lost rather than rushing to catch up.
+    comm: the communicator of the workers sharing the schedule; without one
+    (or synchronize) the schedule starts at the first wait().
+    """
+    def __init__(self, comm=None, rate=120., realtime=False, speed=1., burst=1.):
+        self.comm = comm
+        self.t0 = None
+        self.rate = rate
+        self.realtime = realtime
+        self.speed = speed
+        self.burst = burst
+        #time lost by this rank, moves its schedule later
+        self.offset = 0.
+        self.first = None
+        self.sleeptime = 0.
+
+    def synchronize(self):
+        #collective on comm: start the schedule once all workers are here
+        now=time.time()
+        self.t0=self.comm.allreduce(now, op=MPI.MAX) if self.comm is not None else now
+        self.offset=0.
+
+    def start(self, eventtime):
+        #timestamp of the first event of the run, the same on every rank
+        self.first = eventseconds(eventtime)
+
+    def wait(self, nevent, eventtime=None):
+        """
+        wait until event nevent (with timestamp eventtime) is due. Returns
+        the time slept.
+        """
+        if self.realtime:
+            if self.first is None:
+                self.start(eventtime)
+            due=(eventseconds(eventtime)-self.first)/self.speed
+        elif self.rate is not None:
+            due=nevent/float(self.rate)
+        else:
+            return 0.
+        now=time.time()
+        if self.t0 is None:
+            self.t0=now
+        due+=self.t0+self.offset
+        if now-due>self.burst:
+            self.offset+=now-due-self.burst
+            return 0.
+        if due<=now:
+            return 0.
+        time.sleep(due-now)
+        self.sleeptime+=due-now
+        return due-now
+
+def fromargs(args, comm=None):
+    #clock for --replay: 'max', 'real' or a rate in Hz
+    if args.replay=='max':
+        return replayclock(comm, None)
+    if args.replay=='real':
+        return replayclock(comm, realtime=True, speed=args.replay_speed)
+    return replayclock(comm, float(args.replay))
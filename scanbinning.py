@@ -0,0 +1,181 @@
+import numpy as np
+
+#
+# binned scan sums kept by the master, so the scan plots do not need the
+# event history. For every scan section of smalldata_plot.yml (one with i0var
+# and sigvar) each batch is filtered with the FilterVar ranges, split by
+# lightStatus__laser and added to per-bin sums of i0, sig and the number of
+# events. A batch costs only its own events.
+#
+# Scans of a 'scan' variable are binned by the exact scan value. Delay scans
+# ('delay' or lxt*) are accumulated on fine bins of binResolution and merged
+# into the bins of binWidth (an int: number of bins over the range seen so far,
+# a float: bin width) or of about binEntries laser-on events each when a
+# result is asked for, as the old client side binning did from the history.
+#
+SUMS=('i0_on','i0_off','sig_on','sig_off','nEntries_on','nEntries_off')
+
+class binsums(object):
+    """
+    sums per bin for bins given by sorted keys, for the events of scanVarName
+    seen so far. A binsums is never changed: add() returns a new one, so
+    result() can read one without a lock while the master adds batches.
+    """
+    def __init__(self, scanVarName=None, keys=None, sums=None, nEvts=0, version=0, runNumber=-1):
+        self.scanVarName = scanVarName
+        self.keys = np.zeros(0) if keys is None else keys
+        self.sums = dict((name, np.zeros(0)) for name in SUMS) if sums is None else sums
+        self.nEvts = nEvts
+        self.version = version
+        self.runNumber = runNumber
+
+    def add(self, keys, weights):
+        #weights: name -> array of one weight per key
+        newkeys, inverse = np.unique(keys, return_inverse=True)
+        allkeys=self.keys
+        pos=np.searchsorted(allkeys, newkeys)
+        known=pos<len(allkeys)
+        known[known]=allkeys[pos[known]]==newkeys[known]
+        sums=self.sums
+        if not known.all():
+            allkeys=np.union1d(allkeys, newkeys)
+            old=np.searchsorted(allkeys, self.keys)
+            sums={}
+            for name,arr in self.sums.items():
+                sums[name]=np.zeros(len(allkeys))
+                sums[name][old]=arr
+            pos=np.searchsorted(allkeys, newkeys)
+        idx=pos[inverse]
+        sums=dict((name, sums[name]+np.bincount(idx, w, minlength=len(allkeys))) for name,w in weights.items())
+        return binsums(self.scanVarName, allkeys, sums, self.nEvts+len(keys), self.version+1, self.runNumber)
+
+def isdelay(scanVarName):
+    return scanVarName=='delay' or scanVarName.find('lxt')>=0
+
+class scanbinner(object):
+    """
+    binned sums of one scan section of the setup. add() takes the batches as
+    the master gets them, result() returns the sums per bin. clear() on a new
+    run.
+    """
+    def __init__(self, name, config):
+        self.name = name
+        self.i0var = config['i0var']
+        self.sigvar = config['sigvar']
+        self.filters = list(zip(config.get('FilterVar', []), config.get('FilterVarMin', []), config.get('FilterVarMax', [])))
+        self.scanVar = config.get('scanVar')
+        self.binWidth = config.get('binWidth', 100)
+        self.binEntries = config.get('binEntries', -1)
+        self.resolution = config.get('binResolution', 0.01)
+        self.bins = binsums()
+        self.clear()
+
+    @property
+    def version(self):
+        return self.bins.version
+
+    def clear(self, runNumber=None):
+        if runNumber is None:
+            runNumber=self.bins.runNumber
+        self.bins = binsums(version=self.bins.version+1, runNumber=runNumber)
+
+    def _scanvar(self, columns):
+        if self.scanVar is not None:
+            return self.scanVar if self.scanVar in columns else None
+        scanVarName=None
+        for key in columns:
+            if key.find('scan')>=0:
+                scanVarName=key
+        if scanVarName is None and 'delay' in columns:
+            scanVarName='delay'
+        return scanVarName
+
+    def add(self, columns):
+        """
+        add the events of one batch given as [(name, array)]. Returns the
+        number of events that passed the filters.
+        """
+        columns=dict(columns)
+        scanVarName=self._scanvar(columns)
+        needed=[v for v,fMin,fMax in self.filters]+[self.sigvar, 'lightStatus__laser']
+        if self.i0var!='nEntries':
+            needed.append(self.i0var)
+        if scanVarName is None or any(name not in columns for name in needed):
+            return 0
+        sig=columns[self.sigvar]
+        if sig.ndim!=1:
+            print('scanbinning %s: %s is not one number per event, skipping'%(self.name, self.sigvar))
+            return 0
+        scan=columns[scanVarName]
+        total_filter=np.isfinite(scan)
+        for filterV,fMin,fMax in self.filters:
+            total_filter&=columns[filterV]>fMin
+            total_filter&=columns[filterV]<fMax
+        scan=scan[total_filter]
+        sig=sig[total_filter].astype(float)
+        if self.i0var=='nEntries':
+            i0=np.ones_like(sig)
+        else:
+            i0=columns[self.i0var][total_filter].astype(float)
+        on=(columns['lightStatus__laser'][total_filter]>0).astype(float)
+        off=1.-on
+        if isdelay(scanVarName):
+            keys=np.floor(scan/self.resolution).astype(np.int64)
+        else:
+            keys=scan
+        bins=self.bins
+        if scanVarName!=bins.scanVarName:
+            bins=binsums(scanVarName, np.zeros(0, dtype=keys.dtype), version=bins.version, runNumber=bins.runNumber)
+        self.bins=bins.add(keys, {'i0_on': i0*on, 'i0_off': i0*off,
+                                  'sig_on': sig*on, 'sig_off': sig*off,
+                                  'nEntries_on': on, 'nEntries_off': off})
+        return len(keys)
+
+    def _rebin(self, points, sums):
+        #merge the fine delay bins into the configured ones
+        if len(points)==0:
+            return points, sums
+        if self.binEntries>0:
+            #about binEntries laser on events per bin
+            before=np.cumsum(sums['nEntries_on'])-sums['nEntries_on']
+            group=(before//self.binEntries).astype(int)
+            first=np.concatenate([[0], np.nonzero(np.diff(group))[0]+1])
+            group=np.cumsum(np.concatenate([[0], np.diff(group)>0])).astype(int)
+            points=points[first]
+        else:
+            start=points[0]
+            if isinstance(self.binWidth, float):
+                width=self.binWidth
+            else:
+                width=(points[-1]-start)/max(self.binWidth-1, 1) or self.resolution
+            group=np.floor((points-start)/width+1e-9).astype(int)
+            points=start+np.arange(group[-1]+1)*width
+        sums=dict((name, np.bincount(group, arr, minlength=len(points))) for name,arr in sums.items())
+        return points, sums
+
+    def result(self):
+        """
+        dict with scanVar, scanPoints (the scan value, or the lower bin edge
+        for delay scans), the sums per bin in SUMS, nEvts and runNumber.
+        """
+        bins=self.bins
+        scanVarName=bins.scanVarName
+        points=bins.keys
+        sums=bins.sums
+        data={'nEvts': bins.nEvts, 'runNumber': bins.runNumber, 'version': bins.version}
+        if scanVarName is not None and isdelay(scanVarName):
+            points,sums=self._rebin(points*self.resolution, sums)
+        data.update(sums)
+        data['scanVar']=scanVarName
+        data['scanPoints']=np.asarray(points, dtype=float)
+        return data
+
+def fromsetup(setupDict):
+    """
+    a scanbinner for every section of setupDict listed under master: scans,
+    by default for every section with an i0var and a sigvar.
+    """
+    names=setupDict['master'].get('scans')
+    if names is None:
+        names=[name for name,config in setupDict.items() if isinstance(config, dict) and 'i0var' in config and 'sigvar' in config]
+    return dict((name, scanbinner(name, setupDict[name])) for name in names)
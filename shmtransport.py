@@ -0,0 +1,76 @@
+import numpy as np
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+rank = comm.Get_rank()
+size = comm.Get_size()
+
+#transport set up by setup(); mpidata uses it when it is not given one.
+active = None
+
+class shmtransport(object):
+    """
+    shared memory slots for batches between ranks on the same host.
+    Every rank whose parent runs on its host owns nslots slots of slotsize
+    bytes in an MPI shared window. It packs a batch straight into a free slot
+    and only a small notice goes through MPI; the parent reads the batch in
+    place and hands the slot back (with the flow control credit, see mpidata)
+    once it has been consumed.
+    """
+    def __init__(self, parents, slotsize, nslots):
+        self.nodecomm = comm.Split_type(MPI.COMM_TYPE_SHARED)
+        #world rank -> rank in the node communicator
+        self.noderanks = dict((r,i) for i,r in enumerate(self.nodecomm.allgather(rank)))
+        self.parent = parents[rank]
+        self.slotsize = slotsize
+        self.nslots = nslots
+        self.sends = self.parent in self.noderanks and slotsize>0 and nslots>0
+        nbytes = slotsize*nslots if self.sends else 0
+        self.win = MPI.Win.Allocate_shared(nbytes, 1, comm=self.nodecomm)
+        self.win.Lock_all(MPI.MODE_NOCHECK)
+        self.segments = {}
+        self.freeslots = list(range(nslots)) if self.sends else []
+
+    def samehost(self, r):
+        return r in self.noderanks
+
+    def enabled(self, dest):
+        return self.sends and dest==self.parent
+
+    def _segment(self, owner):
+        segment=self.segments.get(owner)
+        if segment is None:
+            buf,dispunit=self.win.Shared_query(self.noderanks[owner])
+            segment=np.frombuffer(buf, dtype=np.uint8)
+            self.segments[owner]=segment
+        return segment
+
+    def getslot(self):
+        #a free slot of our own, None if all are still being read
+        if len(self.freeslots)==0:
+            return None
+        return self.freeslots.pop()
+
+    def slotbuffer(self, slot):
+        return self._segment(rank)[slot*self.slotsize:(slot+1)*self.slotsize]
+
+    def publish(self):
+        #make the slot contents visible before the notice goes out
+        self.win.Sync()
+
+    def read(self, owner, slot):
+        self.win.Sync()
+        return self._segment(owner)[slot*self.slotsize:(slot+1)*self.slotsize]
+
+    def freeslot(self, slot):
+        #the parent has consumed the batch in slot
+        self.freeslots.append(slot)
+
+def setup(parents, slotsize=4<<20, nslots=4):
+    """
+    create the shared memory transport for the rank layout given by parents
+    (parent rank of every rank, None for the master). Collective: all ranks
+    need to call this. slotsize=0 switches it off.
+    """
+    global active
+    active = shmtransport(parents, slotsize, nslots)
+    return active
@@ -6,6 +6,7 @@ import time
 import socket
 
 import numpy as np
+from dataservice import topictail
 
 if __name__ == '__main__':
     plotName=None
@@ -25,16 +26,22 @@ if __name__ == '__main__':
     context = zmq.Context()
     socket = context.socket(zmq.SUB)        
     socket.connect("tcp://%s:%d" %('daq-xpp-mon05', 5000))
-    socket.setsockopt(zmq.SUBSCRIBE, b"")
+    #only the variables we bin (and any scan variable) are sent to us
+    names=[sigvar, 'lightStatus__laser', 'lightStatus__xray', 'delay', 'enc__lasDelay']+list(FilterVar)
+    if i0var!='nEntries':
+        names.append(i0var)
+    tail=topictail(setupDict['master'].get('number_of_events', 14400), set(names), prefixes=['scan'])
+    tail.subscribe(socket)
 
     #if socket.poll(timeout=0):
     nrep=1
     while nrep>0:
-        socket.send_string("Request_for test")
+        data_dict = tail.update(socket)
+        if data_dict is None:
+            print("nothing published yet")
+            continue
         nowStr = time.strftime("%b %d %Y %H:%M:%S", time.localtime())
-        print("test requested data at %s "%(nowStr))
-        data_dict = socket.recv_pyobj()
-        print("got data")
+        print("got data at %s "%(nowStr))
 
         data={'scanSteps':[]}
         data['scanValues_on']=[]
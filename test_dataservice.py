@@ -0,0 +1,88 @@
+import threading
+import time
+import numpy as np
+import dataservice
+import zmqcodec
+from columnstore import columnstore, eventns
+
+#
+# stress check of the lock-free reads: one thread appends batches (and now and
+# then clears the store) while reader threads share one responsecache and ask
+# for time windows and tails, as the worker threads of dataservice.serve do.
+# Row r of the store has x=r, y=2r and an event time of r ms, so a torn or
+# misaligned reply shows up. python test_dataservice.py [seconds]
+#
+
+T0=1600000000
+
+def _batch(first, n):
+    rows=np.arange(first, first+n)
+    event_time=np.stack([T0+rows//1000, (rows%1000)*1000000], 1).astype(np.uint32)
+    columns=[('event_time', event_time), ('x', rows.astype(float)), ('y', (rows*2).astype(np.int64)), ('nEvts', np.array([n]))]
+    if first%3==0:
+        #a column not every batch has
+        columns.append(('z', rows.astype(float)))
+    return columns
+
+def _consistent(request, data):
+    x=data['x']
+    y=data['y']
+    t=eventns(data['event_time'])
+    rows=(t-T0*10**9)//10**6
+    if not (len(x)==len(y)==len(t) and np.array_equal(x, rows) and np.array_equal(y, 2*rows)):
+        return False
+    if b'tail' in request:
+        return bool(np.all(np.diff(x)==1))
+    return bool(np.all(np.diff(t)>=0))
+
+def stress(seconds=2., nreaders=4, capacity=500):
+    store=columnstore(capacity)
+    cache=dataservice.responsecache()
+    requests=(dataservice.windowrequest(0.2), b'{"tail": 450}', dataservice.windowrequest(window=[T0+0.05, T0+0.3]))
+    stop=[False]
+    counts={'reads': 0, 'bad': 0}
+    countlock=threading.Lock()
+
+    def writer():
+        first=0
+        while not stop[0]:
+            n=np.random.randint(1, 120)
+            store.append(_batch(first, n))
+            first+=n
+            if np.random.rand()<0.002:
+                store.clear()
+                first=0
+
+    def reader():
+        reads=bad=0
+        while not stop[0]:
+            for request in requests:
+                data=zmqcodec.decode(dataservice.reply(store, request, cache))
+                if 'x' not in data:
+                    continue
+                reads+=1
+                if not _consistent(request, data):
+                    bad+=1
+        with countlock:
+            counts['reads']+=reads
+            counts['bad']+=bad
+
+    threads=[threading.Thread(target=writer)]+[threading.Thread(target=reader) for i in range(nreaders)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop[0]=True
+    for thread in threads:
+        thread.join()
+    return counts['reads'], counts['bad'], cache
+
+def test_concurrent_reads():
+    reads,bad,cache=stress()
+    assert reads>0
+    assert bad==0
+    assert len(cache.entries)<=cache.maxsize
+
+if __name__=='__main__':
+    import sys
+    reads,bad,cache=stress(float(sys.argv[1]) if len(sys.argv)>1 else 8.)
+    print('%d replies, %d torn or misaligned, cache hits %d misses %d'%(reads, bad, cache.hits, cache.misses))
@@ -1,5 +1,6 @@
 import sys
 import zmq
+import zmqcodec
 import yaml
 import time
 import socket
@@ -20,7 +21,7 @@ if __name__ == '__main__':
         nowStr = time.strftime("%b %d %Y %H:%M:%S", time.localtime())
         print("test requested data at %s "%(nowStr))
 
-        data_dict = socket.recv_pyobj()
+        data_dict = zmqcodec.recvdict(socket)
         laser = data_dict['lightStatus__laser']
 
         print("got data with length %d and keys: "%laser.shape)
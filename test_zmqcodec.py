@@ -0,0 +1,52 @@
+import numpy as np
+import zmq
+import zmqcodec
+
+#
+# round trips through zmqcodec, with python2 (the clients and the master) and
+# python3: python test_zmqcodec.py or pytest test_zmqcodec.py
+#
+
+def _data():
+    return {'x': np.arange(5.),
+            'img': np.arange(12, dtype=np.int16).reshape(3,4)[:, ::2],
+            'runNumber': np.int64(12),
+            'seq': (3, 40),
+            'reset': False}
+
+def _check(data):
+    assert data['x'].dtype==np.float64 and list(data['x'])==list(range(5))
+    assert data['img'].shape==(3,2) and data['img'].dtype==np.int16
+    assert (data['img']==np.arange(12).reshape(3,4)[:, ::2]).all()
+    assert data['runNumber']==12
+    assert data['seq']==[3, 40]
+    assert data['reset'] is False
+    assert not data['x'].flags.writeable
+
+def test_decode():
+    frames=[frame if isinstance(frame, bytes) else frame.tobytes() for frame in zmqcodec.encode(_data())]
+    _check(zmqcodec.decode(frames))
+    _check(zmqcodec.decode([memoryview(frame) for frame in frames]))
+
+def test_recvdict():
+    context=zmq.Context()
+    sender=context.socket(zmq.PAIR)
+    sender.bind('inproc://test_zmqcodec')
+    receiver=context.socket(zmq.PAIR)
+    receiver.connect('inproc://test_zmqcodec')
+    try:
+        zmqcodec.senddict(sender, _data())
+        _check(zmqcodec.recvdict(receiver))
+        zmqcodec.senddict(sender, _data(), topic=b'ipm2__sum')
+        topic,data=zmqcodec.recvdict(receiver, topic=True)
+        assert topic==b'ipm2__sum'
+        _check(data)
+    finally:
+        sender.close()
+        receiver.close()
+        context.term()
+
+if __name__=='__main__':
+    test_decode()
+    test_recvdict()
+    print('zmqcodec round trips ok')
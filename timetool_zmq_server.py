@@ -1,5 +1,6 @@
 import sys
 import zmq
+import zmqcodec
 import traceback
 
 import numpy as np
@@ -144,7 +145,7 @@ class BokehApp:
             timetool_t = deque(maxlen=self.maxlen)
 
             if socket.poll(timeout=0):
-                data_dict = socket.recv_pyobj()
+                data_dict = zmqcodec.recvdict(socket)
                 timetool_d = data_dict['tt__FLTPOS_PS']
 
                 # Get time from data_dict
@@ -173,7 +174,7 @@ class BokehApp:
             ipm_d = deque(maxlen=self.maxlen)
 
             if socket.poll(timeout=0):
-                data_dict = socket.recv_pyobj()
+                data_dict = zmqcodec.recvdict(socket)
                 timetool_d = data_dict['tt__AMPL']
                 ipm_d = data_dict[self.switchButton]
 
@@ -193,7 +194,7 @@ class BokehApp:
             ipm_d = deque(maxlen=self.maxlen)
 
             if socket.poll(timeout=0):
-                data_dict = socket.recv_pyobj()
+                data_dict = zmqcodec.recvdict(socket)
                 timetool_d = data_dict['tt__FLTPOS_PS']
                 ipm_d = data_dict[self.switchButton]
 
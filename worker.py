@@ -5,6 +5,8 @@ import logging
 import requests
 
 from mpidata import mpidata 
+from batchbuilder import batchbuilder, flattenplan, sendpolicy
+import eventselection
 
 from smalldata_tools.DetObject import DetObject
 from smalldata_tools.SmallDataUtils import defaultDetectors
@@ -46,7 +48,14 @@ ws_url = "https://pswww.slac.stanford.edu/ws/lgbk"
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def runworker(args):
+def runworker(args, topo=None, policy=None, clock=None):
+    #topo: aggregator.topology, None if all workers send to the master
+    #clock: replay.replayclock pacing the events of xtc files, None for no pacing
+    #policy: what to do when the master has no credits left for us, see mpidata
+    if topo is None:
+        dest, workerindex, nworkers = 0, rank-1, size-1
+    else:
+        dest, workerindex, nworkers = topo.parent, topo.workerindex, topo.nworkers
     if args.exprun.find('shmem')<0:
         #get last run from experiment to extract calib info in DetObject
         dsname = args.exprun+':smd'
@@ -114,11 +123,9 @@ def runworker(args):
 
     import time
     time0=time.time()
-    timeLastEvt=time0
-    #slow down code when playing xtc files to look like real data
-    timePerEvent=(1./120.)*(size-1)#time one event should take so that code is running 120 Hz
 
-    sendFrequency=50 #send whenever rank has seen x events
+    #send whenever rank has seen x events, or its oldest event waited batch_age seconds
+    sendPolicy=sendpolicy(args.batch_size, args.batch_age, args.batch_adaptive, args.batch_latency, args.master_batchrate, nworkers)
     #took out lightStatus__xray as we only send events that are not dropped now....
     #take out l3E as we make these plots using EPICS
     #vars_to_send=[]
@@ -128,47 +135,92 @@ def runworker(args):
 #                      'lightStatus__laser','tt__FLTPOS','tt__AMPL','tt__ttCorr','enc__lasDelay']
     #vars_to_send_user=[]
     vars_to_send_user = ['epix_2__ROI_0_thresAdu50_data', 'epix10k2M__ROI_0_sum', 'epix10k2M__ROI_1_sum']
-
-    masterDict={}
+    sendset=set(vars_to_send)
+    usersendset=set(vars_to_send_user)
+
+    def selectdefault(name):
+        if name.find('scan__varStep')>=0 or name.find('damage__scan')>=0:
+            return False
+        return len(sendset)==0 or name in sendset or name.find('scan')>=0
+
+    def selectdefaultplain(name):
+        return len(sendset)==0 or name in sendset
+
+    def selectuser(name):
+        return len(usersendset)==0 or name in usersendset
+
+    #which values of defData and userDict go into which column, worked out
+    #on the first event and again only when the detectors change.
+    #plain (not per detector) user values are not sent.
+    defplan=flattenplan(selectdefault, selectdefaultplain)
+    userplan=flattenplan(selectuser, lambda name: False)
+
+    #event selection from the setup, plus no damage in our own detectors
+    selection=eventselection.fromfile(extra=[{'damage': det._name} for det in dets])
+
+    #one mpidata for the whole run: its send buffers alternate so we keep
+    #processing events while the previous batch is still in flight.
+    md=mpidata(nbuffers=2, dest=dest, policy=policy)
+    #the events of the next batch, written in place into typed columns
+    batch=batchbuilder(sendPolicy.size)
+
+    def sendbatch(nevent, evt):
+        #print 'send data, looked at %d events, total ~ %d, run time %g, in rank %d '%(nevent, nevent*(size-1), (time.time()-time0),rank)
+        if workerindex==0 and nevent>0:
+            if args.exprun.find('shmem')<0:
+                print 'send data, looked at %d events/rank, total ~ %d, run time %g, approximate rate %g from rank %d, waited %g s for replay'%(nevent, nevent*nworkers, (time.time()-time0), nevent*nworkers/(time.time()-time0), rank, clock.sleeptime if clock is not None else 0.)
+            else:
+                print 'send data, looked at %d events/rank, total ~ %d, run time %g, est. rate %g from rank %d, total est rate %g'%(nevent, nevent*nworkers, (time.time()-time0), nevent/(time.time()-time0), rank, nevent*nworkers/(time.time()-time0))
+        #a batch sent before it is full goes out in chunks of powers of two
+        start=0
+        for nrows in sendPolicy.chunks(batch.nrows):
+            #I think add a list of keys of the data dictionary to the client.
+            md.addarray('nEvts',np.array([nevent]))
+            md.addarray('nEvts_sent',np.array([nrows]))
+            md.addarray('send_timeStamp', np.array(evt.get(psana.EventId).time()))
+            #views of the batch buffers: packed into the send buffer, not converted
+            for key,arr in batch.columns(start, start+nrows):
+                md.addarray(key,arr)
+                print 'worker: adding %s array of shape %d'%(key, len(arr))
+            stall=md.isend()
+            if stall>0:
+                print 'worker: rank %d stalled %g s waiting for a credit or a free send buffer, total %g s in %d stalls'%(rank, stall, md.stalltime, md.nstalls)
+            start+=nrows
+        if workerindex==0:
+            print 'worker: rank %d %s'%(rank, selection.summary())
+        if md.nBatches_dropped>0 or md.nEvts_dropped>0:
+            print 'worker: rank %d master is behind, dropped %d batches and %d events so far'%(rank, md.nBatches_dropped, md.nEvts_dropped)
+        print 'worker: batch columns', batch.names
+
+        #the batch has been packed, reuse its buffers for the next one.
+        sendPolicy.sent(batch.nrows, time.time())
+        batch.clear()
+
+    #the replay schedule starts now, on all workers together
+    if clock is not None:
+        clock.synchronize()
     for nevent,evt in enumerate(ds.events()):
         if nevent == args.noe : break
+        #a partial batch also goes out in time when the events after it are
+        #skipped or rejected
+        if sendPolicy.due(batch.nrows, time.time()):
+            sendbatch(nevent, evt)
         if args.exprun.find('shmem')<0:
-            if nevent%(size-1)!=rank-1: continue # different ranks look at different events
-        #print 'pass here: ',nevent, rank, nevent%(size-1)
+            if nevent==0 and clock is not None and clock.realtime:
+                clock.start(evt.get(psana.EventId).time())
+            if nevent%nworkers!=workerindex: continue # different ranks look at different events
+            #slow down when playing xtc files to look like real data: wait for this event's turn
+            if clock is not None:
+                clock.wait(nevent, evt.get(psana.EventId).time() if clock.realtime else None)
+        #print 'pass here: ',nevent, rank, nevent%nworkers
         defData = detData(defaultDets, evt)
 
         ###
         #event selection.
         ###
         #check that all required detectors are ok - this should ensure that we don't need to do any fancy event matching/filling at the cost of losing events.
-        #print 'defData: ',defData.keys()
-        if 'ipm2' in defData.keys() and defData['damage']['ipm2'] < 1:
-            continue
-        if 'ipm5' in defData.keys() and defData['damage']['ipm5'] < 1:
-            continue            
-        if defData['damage']['evr0'] < 1:
-            continue
-
-        try:
-            if defData['damage']['tt'] < 1:
-                continue
-        except:
-            pass
-
-        try:
-            if defData['damage']['enc'] < 1:
-                continue
-        except:
-            pass
-
-        damageDet=1
-        for det in dets:
-            try:
-                if defData['damage'][det._name] < 1:
-                    damageDet=0
-            except:
-                pass
-        if damageDet < 1:
+        #the rules are in the event_selection section of smalldata_plot.yml.
+        if not selection(defData):
             continue
 
         #loop over defined detectors: if requested, need them not to damage.
@@ -199,52 +251,13 @@ def runworker(args):
             continue
         
         #here we should append the current dict to a dict that will hold a subset of events.
-        for key in defData:
-            if isinstance(defData[key], dict):
-                for skey in defData[key].keys():
-                    if isinstance(defData[key][skey], dict):
-                        print 'why do I have this level of dict?', key, skey, defData[key][skey].keys()
-                        continue
-                    varname_in_masterDict = '%s__%s'%(key, skey)
-                    if len(vars_to_send)>0 and varname_in_masterDict not in vars_to_send and varname_in_masterDict.find('scan')<0:
-                        continue
-                    if varname_in_masterDict.find('scan__varStep')>=0:
-                        continue
-                    if varname_in_masterDict.find('damage__scan')>=0:
-                        continue
-                    if varname_in_masterDict not in masterDict.keys():
-                        masterDict[varname_in_masterDict] = [defData[key][skey]]
-                    else:
-                        masterDict[varname_in_masterDict].append(defData[key][skey])
-            else:
-                if len(vars_to_send)>0 and key not in vars_to_send:
-                    continue
-                if key not in masterDict.keys():
-                    masterDict[key]=[defData[key]]
-                else:
-                    masterDict[key].append(defData[key])
-
-        for key in userDict:
-            if isinstance(userDict[key], dict):
-                for skey in userDict[key].keys():
-                    if isinstance(userDict[key][skey], dict):
-                        print 'why do I have this level of dict?', key, skey, userDict[key][skey].keys()
-                        continue
-                    varname_in_masterDict = '%s__%s'%(key, skey)
-                    if len(vars_to_send_user)>0 and varname_in_masterDict not in vars_to_send_user:
-                        continue
-                    if varname_in_masterDict not in masterDict.keys():
-                        masterDict[varname_in_masterDict] = [userDict[key][skey]]
-                    else:
-                        masterDict[varname_in_masterDict].append(userDict[key][skey])
+        defplan.fill(defData, batch)
+        userplan.fill(userDict, batch)
 
         ###
         # add event time
         ###
-        if 'event_time' not in masterDict.keys():
-            masterDict['event_time'] = [evt.get(psana.EventId).time()]
-        else:
-            masterDict['event_time'].append(evt.get(psana.EventId).time())
+        batch.set('event_time', evt.get(psana.EventId).time())
         ###
         # add delay
         ###
@@ -252,40 +265,15 @@ def runworker(args):
             delay=defData['tt__ttCorr'] + defData['enc__lasDelay'] 
         except:
             delay=0.
-        if 'delay' not in masterDict.keys():
-            masterDict['delay'] = [delay]
-        else:
-            masterDict['delay'].append(delay)
+        batch.set('delay', delay)
+        batch.next()
 
-        #make this run at 120 Hz - slow down if necessary
         # send mpi data object to master when desired
         #not sure how this is supposed to work...
-        #print 'send: ', len(masterDict['event_time'])%sendFrequency, len(masterDict['event_time']), sendFrequency
-        #print 'masterdict ',nevent, rank, nevent%(size-1), masterDict.keys()
-        if len(masterDict['event_time'])%sendFrequency == 0:
-            timeNow = time.time()
-            if (timeNow - timeLastEvt) < timePerEvent*sendFrequency:
-                time.sleep(timePerEvent*sendFrequency-(timeNow - timeLastEvt))
-                timeLastEvt=time.time()
-            #print 'send data, looked at %d events, total ~ %d, run time %g, in rank %d '%(nevent, nevent*(size-1), (time.time()-time0),rank)
-            if rank==1 and nevent>0:
-                if args.exprun.find('shmem')<0:
-                    print 'send data, looked at %d events/rank, total ~ %d, run time %g, approximate rate %g from rank %d'%(nevent, nevent*(size-1), (time.time()-time0), nevent*(size-1)/(time.time()-time0), rank)
-                else:
-                    print 'send data, looked at %d events/rank, total ~ %d, run time %g, est. rate %g from rank %d, total est rate %g'%(nevent, nevent*(size-1), (time.time()-time0), nevent/(time.time()-time0), rank, nevent*(size-1)/(time.time()-time0))
-            md=mpidata()
-            #I think add a list of keys of the data dictionary to the client.
-            md.addarray('nEvts',np.array([nevent]))
-            md.addarray('nEvts_sent',np.array([len(masterDict['event_time'])]))
-            md.addarray('send_timeStamp', np.array(evt.get(psana.EventId).time()))
-            for key in masterDict.keys():
-                md.addarray(key,np.array(masterDict[key]))
-                print 'worker: adding %s array of shape %d'%(key, len(masterDict[key]))
-            md.send()
-            print 'worker: masterDict.keys()', masterDict.keys()
-
-            #now reset the local dictionay/lists.
-            masterDict={}
+        #print 'send: ', batch.nrows, sendPolicy.size
+        #print 'masterdict ',nevent, rank, nevent%(size-1), batch.names
+        if sendPolicy.due(batch.nrows, time.time()):
+            sendbatch(nevent, evt)
 
     #should be different for shared memory. R
     try:
@@ -0,0 +1,76 @@
+import json
+import numpy as np
+
+#
+# multipart framing for the dicts of numpy arrays the master sends to its
+# clients, instead of pickling them. The first frame is a JSON header
+#   {"columns": [[name, dtype, shape], ...], "values": {name: value}}
+# followed by one frame per column with the raw array data, sent without a
+# copy. values holds everything that is not an array (run number, sequence
+# number, reset flag). The receiver makes the arrays with np.frombuffer on
+# the received frames, again without a copy, so they are read-only.
+# On PUB/SUB sockets a topic frame goes in front.
+#
+
+def _plain(value):
+    #json has no numpy scalars or tuples
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, tuple):
+        return [_plain(v) for v in value]
+    return value
+
+def encode(data):
+    """
+    list of frames for the dict data: the header and one contiguous array
+    per column. Arrays are not copied unless they are not contiguous.
+    """
+    columns=[]
+    arrays=[]
+    values={}
+    for name,value in data.items():
+        if isinstance(value, np.ndarray):
+            arr=np.ascontiguousarray(value)
+            columns.append([name, arr.dtype.str, list(arr.shape)])
+            arrays.append(arr)
+        else:
+            values[name]=_plain(value)
+    header=json.dumps({'columns': columns, 'values': values}).encode('utf-8')
+    return [header]+arrays
+
+def _buffer(frame):
+    #zmq.Frame from recv_multipart(copy=False), or plain bytes. numpy on py2
+    #cannot read a memoryview, but takes the frame itself.
+    if bytes is str:
+        return frame.tobytes() if isinstance(frame, memoryview) else frame
+    return frame.buffer if hasattr(frame, 'buffer') else frame
+
+def _bytes(frame):
+    #the frame as a byte string; on py2 bytes(memoryview) is its repr, not its data
+    if hasattr(frame, 'bytes'):
+        return frame.bytes
+    if isinstance(frame, memoryview):
+        return frame.tobytes()
+    return bytes(frame)
+
+def decode(frames):
+    header=json.loads(_bytes(frames[0]).decode('utf-8'))
+    data=dict(header['values'])
+    for (name,dtype,shape),frame in zip(header['columns'], frames[1:]):
+        arr=np.frombuffer(_buffer(frame), dtype=np.dtype(dtype)).reshape(shape)
+        arr.flags.writeable=False
+        data[name]=arr
+    return data
+
+def senddict(socket, data, flags=0, topic=None):
+    frames=encode(data)
+    if topic is not None:
+        frames=[topic]+frames
+    socket.send_multipart(frames, flags=flags, copy=False)
+
+def recvdict(socket, flags=0, topic=False):
+    #with topic=True returns (topic, data)
+    frames=socket.recv_multipart(flags=flags, copy=False)
+    if topic:
+        return _bytes(frames[0]), decode(frames[1:])
+    return decode(frames)